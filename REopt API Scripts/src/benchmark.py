@@ -0,0 +1,286 @@
+"""
+End-to-end benchmark of the multi-site workflow against the local mock API (src.mock_api_server):
+    parse     multi_site_csv_parser on N synthetic scenarios generated from archived_v2_scripts/inputs/scenarios.csv
+    submit    get_api_results for every post, with `concurrency` jobs in flight (POST, poll and save)
+    load      load_results for every saved response
+    csv       parse_responses_to_csv_with_template with archived_v2_scripts/outputs/results_template.csv
+    excel     parse_api_responses_to_excel (on the first --excel-scenarios responses, since it writes every time series)
+Each stage reports throughput and per-item latency percentiles (where items are timed individually), and with
+--trace-memory the peak Python memory (tracemalloc slows the stages down, so compare timings only between runs with
+the same setting). Save a report with --report and pass it to --compare on a later run to see the change of every
+metric, e.g. after changing --concurrency or --compression. The mock API runs in the same process, so the submit stage
+includes the (small) cost of serving responses.
+
+Run from the "REopt API Scripts" directory:
+    python -m src.benchmark --n-scenarios 200 --concurrency 50 --compression gzip --report bench.json
+
+By default the mock serves the archived v2 responses so that every stage runs. Use --shape v3 to run the stages on the
+v3 outputs/results_file.json instead, with the csv stage pulling the v3 names of the results template's outputs
+(V3_TEMPLATE_COLUMNS); the parse and excel stages are skipped, since multi_site_csv_parser builds v2 posts and
+parse_api_responses_to_excel only reads v2 responses.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.logger import log
+from src.http_session import configure_rate_limit, configure_session
+from src.mock_api_server import start_mock_api_server
+from src.multi_site_inputs_parser import multi_site_csv_parser
+from src.parse_api_responses_to_csv import parse_responses_to_csv_with_template
+from src.parse_api_responses_to_excel import parse_api_responses_to_excel
+from src.post_and_poll import get_api_results_async
+from src.results_storage import load_results
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.path.join(SRC_DIR, '..', 'archived_v2_scripts')
+SCENARIOS_CSV = os.path.join(ARCHIVE_DIR, 'inputs', 'scenarios.csv')
+RESULTS_TEMPLATE = os.path.join(ARCHIVE_DIR, 'outputs', 'results_template.csv')
+V2_RESPONSES = [os.path.join(ARCHIVE_DIR, 'outputs', 'site3-No-PV.json'),
+                os.path.join(ARCHIVE_DIR, 'outputs', 'site3-With-PV.json')]
+V3_RESPONSES = [os.path.join(SRC_DIR, '..', 'outputs', 'results_file.json')]
+# v3 names of the outputs in RESULTS_TEMPLATE
+V3_TEMPLATE_COLUMNS = ['npv', 'PV|size_kw', 'ElectricStorage|size_kw', 'ElectricStorage|size_kwh',
+                       'ElectricTariff|year_one_bill_before_tax', 'ElectricTariff|year_one_bill_before_tax_bau',
+                       'Financial|lifecycle_capital_costs_plus_om_after_tax']
+EXCEL_TEMPLATE = os.path.join(SRC_DIR, 'template.xlsx')
+
+
+def make_synthetic_scenarios(n_scenarios, path_to_csv, seed=0):
+    """
+    Write a scenarios csv with n_scenarios rows, cycling through the rows of archived_v2_scripts/inputs/scenarios.csv
+    with the site location and PV size perturbed
+    :param n_scenarios: number of rows to write
+    :param path_to_csv: output path
+    :param seed: random seed
+    :return: None
+    """
+    rng = random.Random(seed)
+    with open(SCENARIOS_CSV, 'r', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+    with open(path_to_csv, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        for i in range(n_scenarios):
+            row = dict(rows[i % len(rows)])
+            row['site_number'] = i + 1
+            row['description'] = '{}-{}'.format(row['description'], i + 1)
+            row['latitude'] = round(float(row['latitude']) + rng.uniform(-1, 1), 4)
+            row['longitude'] = round(float(row['longitude']) + rng.uniform(-1, 1), 4)
+            if row.get('PV|max_kw', '') != '':
+                row['PV|max_kw'] = rng.choice([0, 100, 500, 1000])
+            writer.writerow(row)
+
+
+def percentiles(latencies):
+    """
+    :param latencies: list of seconds
+    :return: dict of p50, p90, p99 and max latency (seconds), or empty dict if there are no latencies
+    """
+    if not latencies:
+        return dict()
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'p50_s': p50, 'p90_s': p90, 'p99_s': p99, 'max_s': max(latencies)}
+
+
+def run_stage(name, func, n_items, trace_memory=False):
+    """
+    Time one stage of the pipeline
+    :param name: stage name for the report
+    :param func: callable returning (output, list of per-item latencies or None)
+    :param n_items: number of items the stage processes (for throughput)
+    :param trace_memory: measure peak Python memory with tracemalloc (slows the stage down considerably)
+    :return: (output of func, dict of stage metrics)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output, latencies = func()
+    seconds = time.perf_counter() - start
+    metrics = {'stage': name, 'n': n_items, 'seconds': seconds,
+               'per_second': n_items / seconds if seconds > 0 else None}
+    metrics.update(percentiles(latencies))
+    if trace_memory:
+        metrics['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    log.info("Finished {} stage: {} items in {:.2f}s.".format(name, n_items, seconds))
+    return output, metrics
+
+
+def submit_all(posts, api_url, results_files, concurrency, poll_interval, compression):
+    """
+    Run get_api_results_async for every post, timing each job
+    :return: (list of results, list of per-job seconds)
+    """
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        async def run_one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                results = await get_api_results_async(posts[i], API_KEY='BENCHMARK', api_url=api_url,
+                                                      results_file=results_files[i], poll_interval=poll_interval,
+                                                      executor=executor, compression=compression)
+                return results, time.perf_counter() - start
+
+        try:
+            return await asyncio.gather(*[run_one(i) for i in range(len(posts))])
+        finally:
+            executor.shutdown(wait=False)
+
+    outcomes = asyncio.run(run())
+    return [o[0] for o in outcomes], [o[1] for o in outcomes]
+
+
+def run_benchmark(n_scenarios=100, concurrency=20, poll_interval=0.5, solve_seconds=(1, 3), compression=None,
+                  shape='v2', excel_scenarios=2, workdir=None, trace_memory=False):
+    """
+    Run every stage of the pipeline against a local mock API
+    :param n_scenarios: number of synthetic scenarios
+    :param concurrency: number of jobs in flight in the submit stage
+    :param poll_interval: seconds between polls of each job
+    :param solve_seconds: mock solve time, a number or (min, max)
+    :param compression: None, 'gzip' or 'xz' for saved results
+    :param shape: 'v2' to run every stage on archived v2 responses, 'v3' to submit, load and parse to csv v3 responses
+    :param excel_scenarios: number of responses to export to Excel
+    :param workdir: directory for generated files. Default is a temporary directory that is deleted afterwards.
+    :param trace_memory: measure peak Python memory of each stage
+    :return: list of stage metrics dicts
+    """
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='reopt_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    configure_session(pool_maxsize=max(concurrency, 10))
+    configure_rate_limit(requests_per_second=10000, burst=concurrency)  # the mock does its own limiting, if any
+    if shape == 'v2':
+        server, api_url = start_mock_api_server(api_path='/v2', responses=V2_RESPONSES, solve_seconds=solve_seconds)
+    else:
+        server, api_url = start_mock_api_server(api_path='/stable', responses=V3_RESPONSES,
+                                                solve_seconds=solve_seconds)
+    report = []
+    try:
+        path_to_csv = os.path.join(workdir, 'scenarios.csv')
+        make_synthetic_scenarios(n_scenarios, path_to_csv)
+
+        if shape == 'v2':
+            posts, metrics = run_stage(
+                'parse', lambda: (multi_site_csv_parser(path_to_csv, api_url=api_url, API_KEY='BENCHMARK'), None),
+                n_scenarios, trace_memory)
+            report.append(metrics)
+        else:  # multi_site_csv_parser builds v2 posts; the mock doesn't use the post, so any post will do
+            with open(os.path.join(SRC_DIR, '..', 'inputs', 'post_1.json'), 'r') as f:
+                posts = [json.load(f)] * n_scenarios
+
+        results_files = [os.path.join(workdir, 'results_{}.json'.format(i + 1)) for i in range(n_scenarios)]
+        responses, metrics = run_stage(
+            'submit', lambda: submit_all(posts, api_url, results_files, concurrency, poll_interval, compression),
+            n_scenarios, trace_memory)
+        metrics['mock_requests'] = server.mock_api.n_requests
+        report.append(metrics)
+
+        saved_files = [f for f in os.listdir(workdir) if f.startswith('results_')]
+        metrics = {'stage': 'disk', 'n': len(saved_files),
+                   'mb': sum(os.path.getsize(os.path.join(workdir, f)) for f in saved_files) / 1024 ** 2}
+        report.append(metrics)
+
+        def load_all():
+            loaded, latencies = [], []
+            for f in sorted(saved_files):
+                start = time.perf_counter()
+                loaded.append(load_results(os.path.join(workdir, f)))
+                latencies.append(time.perf_counter() - start)
+            return loaded, latencies
+        _, metrics = run_stage('load', load_all, len(saved_files), trace_memory)
+        report.append(metrics)
+
+        responses = [r for r in responses if r is not None]
+        results_template = RESULTS_TEMPLATE
+        if shape != 'v2':
+            results_template = os.path.join(workdir, 'results_template_v3.csv')
+            with open(results_template, 'w', newline='') as f:
+                csv.writer(f).writerow(V3_TEMPLATE_COLUMNS)
+        _, metrics = run_stage(
+            'csv', lambda: (parse_responses_to_csv_with_template(
+                results_template, responses, os.path.join(workdir, 'results_summary.csv')), None),
+            len(responses), trace_memory)
+        report.append(metrics)
+
+        if shape == 'v2':
+            excel_responses = responses[:excel_scenarios]
+            _, metrics = run_stage(
+                'excel', lambda: (parse_api_responses_to_excel(
+                    excel_responses, template=EXCEL_TEMPLATE,
+                    spreadsheet=os.path.join(workdir, 'results_summary.xlsx')), None),
+                len(excel_responses), trace_memory)
+            report.append(metrics)
+    finally:
+        server.shutdown()
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return report
+
+
+def print_report(report, previous=None):
+    """
+    Print stage metrics as a table, with the percent change from a previous report if given
+    :param report: list of stage metrics dicts from run_benchmark
+    :param previous: optional earlier report to compare to
+    :return: None
+    """
+    previous = {m['stage']: m for m in previous or []}
+    columns = ['n', 'seconds', 'per_second', 'p50_s', 'p90_s', 'p99_s', 'max_s', 'peak_mb', 'mb']
+    print('{:<8}'.format('stage') + ''.join('{:>16}'.format(c) for c in columns))
+    for metrics in report:
+        line = '{:<8}'.format(metrics['stage'])
+        for c in columns:
+            val = metrics.get(c)
+            if val is None:
+                line += '{:>16}'.format('')
+                continue
+            cell = '{:.3g}'.format(val)
+            old = previous.get(metrics['stage'], dict()).get(c)
+            if old:
+                cell += ' ({:+.0f}%)'.format(100.0 * (val - old) / old)
+            line += '{:>16}'.format(cell)
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the REopt API scripts against a local mock API.")
+    parser.add_argument('--n-scenarios', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--solve-seconds', type=float, nargs='+', default=[1, 3], help="seconds, or min and max")
+    parser.add_argument('--compression', choices=['gzip', 'xz'], default=None)
+    parser.add_argument('--shape', choices=['v2', 'v3'], default='v2')
+    parser.add_argument('--excel-scenarios', type=int, default=2)
+    parser.add_argument('--workdir', default=None, help="keep generated files here instead of a temporary directory")
+    parser.add_argument('--trace-memory', action='store_true', help="measure peak Python memory of each stage")
+    parser.add_argument('--report', default=None, help="save the report to this json file")
+    parser.add_argument('--compare', default=None, help="json report from an earlier run to compare to")
+    args = parser.parse_args()
+
+    solve = args.solve_seconds[0] if len(args.solve_seconds) == 1 else tuple(args.solve_seconds[:2])
+    benchmark_report = run_benchmark(
+        n_scenarios=args.n_scenarios, concurrency=args.concurrency, poll_interval=args.poll_interval,
+        solve_seconds=solve, compression=args.compression, shape=args.shape, excel_scenarios=args.excel_scenarios,
+        workdir=args.workdir, trace_memory=args.trace_memory
+    )
+    previous_report = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            previous_report = json.load(f)
+    print_report(benchmark_report, previous_report)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(benchmark_report, f, indent=2)
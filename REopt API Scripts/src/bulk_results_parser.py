@@ -0,0 +1,146 @@
+"""
+Parsing a whole directory of saved responses in parallel, eg. to summarize an existing study again.
+
+Decoding a multi-MB response is CPU bound, so loading results files one at a time uses one core. Here the files are
+split into chunks that are loaded and parsed in a process pool: each process decodes its files (with orjson if it is
+installed, see src.results_storage) and pulls the template's outputs out of them (see src.output_extractor), and only
+the rows of values are sent back to this process. Rows are returned in the order of the files. A file that cannot be
+read is logged (by this process, so that it is in main.log) and its row is all None.
+
+With scan=True the outputs are read with src.result_reader instead of decoding whole files, which is faster when
+orjson is not installed.
+
+Example, from the "REopt API Scripts" directory:
+    rows = parse_results_files('outputs/', ["Financial|npv", "PV|size_kw"], n_workers=8)
+    summarize_results_files('outputs/results_*.json', 'inputs/results_template.csv', 'outputs/results_summary.csv')
+or from the command line:
+    python -m src.bulk_results_parser outputs/ --template inputs/results_template.csv --output-csv summary.csv
+"""
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from src.logger import log
+from src.output_extractor import OutputExtractor
+from src.result_reader import read_fields
+from src.results_storage import load_results
+from src.summary_writer import SummaryWriter
+
+RESULTS_PATTERNS = ['*.json', '*.json.gz', '*.json.xz']
+
+
+def find_results_files(results_files):
+    """
+    :param results_files: directory of saved responses, glob pattern, or list of paths
+    :return: sorted list of paths (for a directory or pattern), or results_files as they are (for a list)
+    """
+    if not isinstance(results_files, str):
+        return list(results_files)
+    if os.path.isdir(results_files):
+        return sorted(fp for pattern in RESULTS_PATTERNS for fp in glob.glob(os.path.join(results_files, pattern)))
+    return sorted(glob.glob(results_files))
+
+
+def parse_chunk(extractor, results_files, scan=False):
+    """
+    :param extractor: OutputExtractor
+    :param results_files: list of paths to saved responses
+    :param scan: if True, read the outputs with src.result_reader instead of decoding the files
+    :return: (rows, errors): list of rows, one per file, and list of (path, error message) of the files that could
+        not be parsed
+    """
+    rows, errors = [], []
+    for fp in results_files:
+        try:
+            if scan:
+                fields = read_fields(fp, extractor.keys)
+                rows.append([fields[key] for key in extractor.keys])
+            else:
+                rows.append(extractor.extract(load_results(fp)))
+        except Exception as e:
+            errors.append((fp, str(e)))
+            rows.append([None] * len(extractor.keys))
+    return rows, errors
+
+
+def log_parse_errors(errors):
+    for fp, e in errors:
+        log.error("Could not parse {}: {}".format(fp, e))
+
+
+def iter_rows(results_files, keys, n_workers=None, chunksize=20, scan=False):
+    """
+    :param results_files: directory of saved responses, glob pattern, or list of paths
+    :param keys: list of "Obj|field" or "field" keys, eg. the header of a results template csv
+    :param n_workers: number of processes, default is the number of CPUs; 1 parses on this process
+    :param chunksize: number of files sent to a process at a time
+    :param scan: if True, read the outputs with src.result_reader instead of decoding the files
+    :return: generator of (path, row), in the order of the files
+    """
+    results_files = find_results_files(results_files)
+    extractor = OutputExtractor(keys)
+    chunks = [results_files[i:i + chunksize] for i in range(0, len(results_files), chunksize)]
+    n_workers = min(n_workers or os.cpu_count() or 1, len(chunks))
+    log.info("Parsing {} results files with {} processes...".format(len(results_files), max(n_workers, 1)))
+    if n_workers <= 1:
+        for chunk in chunks:
+            rows, errors = parse_chunk(extractor, chunk, scan)
+            log_parse_errors(errors)
+            for fp, row in zip(chunk, rows):
+                yield fp, row
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for chunk, (rows, errors) in zip(chunks, executor.map(parse_chunk, [extractor] * len(chunks), chunks,
+                                                              [scan] * len(chunks))):
+            log_parse_errors(errors)
+            for fp, row in zip(chunk, rows):
+                yield fp, row
+
+
+def parse_results_files(results_files, keys, n_workers=None, chunksize=20, scan=False):
+    """
+    :param results_files: directory of saved responses, glob pattern, or list of paths
+    :param keys: list of "Obj|field" or "field" keys
+    :param n_workers: number of processes, default is the number of CPUs
+    :param chunksize: number of files sent to a process at a time
+    :param scan: if True, read the outputs with src.result_reader instead of decoding the files
+    :return: list of rows (lists of values, one per key), in the order of the files
+    """
+    return [row for fp, row in iter_rows(results_files, keys, n_workers=n_workers, chunksize=chunksize, scan=scan)]
+
+
+def summarize_results_files(results_files, csv_template, output_csv, n_workers=None, chunksize=20, scan=False):
+    """
+    Write a summary csv of saved responses, with a "results_file" column to identify each row
+    :param results_files: directory of saved responses, glob pattern, or list of paths
+    :param csv_template: path to csv file with headers for output fields
+    :param output_csv: path to the summary csv
+    :param n_workers: number of processes, default is the number of CPUs
+    :param chunksize: number of files sent to a process at a time
+    :param scan: if True, read the outputs with src.result_reader instead of decoding the files
+    :return: number of rows written
+    """
+    with open(csv_template, 'r') as f:
+        outputs = next(csv.reader(f))
+    summary = SummaryWriter(output_csv, outputs, custom_columns=['results_file'], resume=False)
+    try:
+        for fp, row in iter_rows(results_files, outputs, n_workers=n_workers, chunksize=chunksize, scan=scan):
+            summary.add_row(fp, [fp] + row)
+    finally:
+        summary.close()
+    return summary.finalize(remove_rows=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize saved responses in parallel.")
+    parser.add_argument('results_files', help="directory or glob pattern of saved responses")
+    parser.add_argument('--template', required=True, help="csv file with headers for output fields")
+    parser.add_argument('--output-csv', default='outputs/results_summary.csv')
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default is the CPU count)")
+    parser.add_argument('--chunksize', type=int, default=20)
+    parser.add_argument('--scan', action='store_true', help="read outputs without decoding whole files")
+    args = parser.parse_args()
+
+    summarize_results_files(args.results_files, args.template, args.output_csv, n_workers=args.workers,
+                            chunksize=args.chunksize, scan=args.scan)
@@ -1,7 +1,6 @@
-import requests
-import json
 import pandas as pd
 from src.logger import log
+from src.help_cache import get_input_definitions
 from collections import OrderedDict
 API_KEY = 'DEMO_KEY'
 api_url = 'https://developer.nrel.gov/api/reopt/stable'
@@ -70,8 +69,8 @@ def flatten_nested_dict(nested_dict, flat_dict=None, obj=None):
     return flat_dict
 
 
-def create_input_template_with_values_from_help_endpoint(api_url, API_KEY):
-    input_definitions = json.loads(requests.get(api_url + '/help?API_KEY=' + API_KEY).content)
+def create_input_template_with_values_from_help_endpoint(api_url, API_KEY, help_cache=None):
+    input_definitions = get_input_definitions(api_url, API_KEY, help_cache=help_cache)
     flat_dict = flatten_nested_dict(input_definitions)
     # fill in enough values to run an example
     flat_dict["site_number"] = 1
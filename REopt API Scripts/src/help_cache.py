@@ -0,0 +1,169 @@
+"""
+On-disk cache of /help input definitions, one file per API version.
+
+The definitions only change when the API is updated, so they are reused for ttl_hours and then revalidated with a
+conditional GET (If-None-Match / If-Modified-Since), which costs a 304 with no body when nothing changed. If the API
+can't be reached the last saved definitions are used. In offline mode (or with the environment variable
+REOPT_OFFLINE=1) the API is never called, so parsers can run on machines without network access once the cache
+directory has been copied over.
+
+Example:
+    configure_help_cache(ttl_hours=1)
+    input_definitions = get_input_definitions(api_url, API_KEY)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from src.logger import log
+from src.http_session import get_session
+from src.job_ledger import api_version
+
+_help_cache = None
+_lock = threading.Lock()
+
+
+class HelpCache:
+    """
+    Directory of saved /help responses with their fetch time, ETag and Last-Modified headers. Safe to share between
+    threads.
+    """
+
+    def __init__(self, cache_dir='.reopt_cache/help', ttl_hours=24, offline=None):
+        """
+        :param cache_dir: directory for saved definitions, created if it does not exist
+        :param ttl_hours: hours that saved definitions are used without asking the API if they changed
+        :param offline: if True, only use saved definitions. Default is True if the REOPT_OFFLINE environment variable
+            is set to 1.
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+        if offline is None:
+            offline = os.environ.get('REOPT_OFFLINE', '0') == '1'
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, api_url):
+        """
+        :return: path to the saved definitions for the API version of api_url
+        """
+        key = hashlib.sha256(api_version(api_url).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, 'help_' + key + '.json')
+
+    def load(self, api_url):
+        """
+        :return: saved entry dict (api_url, fetch_time, etag, last_modified, definitions), or None
+        """
+        try:
+            with open(self.path(api_url), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, api_url, entry):
+        fp = self.path(api_url)
+        tmp = fp + '.tmp{}'.format(threading.get_ident())
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(entry))
+        os.replace(tmp, fp)  # atomic, so that other processes never read a partly written file
+
+    def get(self, api_url, API_KEY, refresh=False):
+        """
+        :param api_url:
+        :param API_KEY:
+        :param refresh: if True, revalidate saved definitions even if they are younger than ttl_hours
+        :return: nested_input_definitions from help endpoint
+        """
+        with self._lock:
+            entry = self.load(api_url)
+            if entry is not None and (self.offline or
+                                      (not refresh and time.time() - entry['fetch_time'] < self.ttl_seconds)):
+                log.debug("Using saved /help definitions from {}".format(self.path(api_url)))
+                return entry['definitions']
+            if self.offline:
+                raise FileNotFoundError("Offline and no saved /help definitions for {} in {}".format(
+                    api_version(api_url), self.cache_dir))
+
+            headers = dict()
+            if entry is not None:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                resp = get_session().get(api_url + '/help?API_KEY=' + API_KEY, headers=headers)
+            except requests.exceptions.RequestException as e:
+                if entry is None:
+                    raise
+                log.warning("Unable to reach {} ({}). Using saved /help definitions from {}".format(
+                    api_url, e, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['fetch_time']))))
+                return entry['definitions']
+
+            if not resp.ok and resp.status_code != 304 and entry is not None:
+                log.warning("Status code {} from {}/help. Using saved /help definitions from {}".format(
+                    resp.status_code, api_version(api_url),
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['fetch_time']))))
+                return entry['definitions']
+            if resp.status_code == 304 and entry is not None:
+                log.debug("/help definitions for {} have not changed.".format(api_version(api_url)))
+            else:
+                input_definitions = json.loads(resp.content)
+                if "error" in input_definitions.keys():
+                    raise BlockingIOError(input_definitions["error"])
+                log.info("Fetched /help definitions from {}.".format(api_version(api_url)))
+                entry = {'api_url': api_version(api_url), 'definitions': input_definitions}
+            entry.update(fetch_time=time.time(), etag=resp.headers.get('ETag', entry.get('etag')),
+                         last_modified=resp.headers.get('Last-Modified', entry.get('last_modified')))
+            self.save(api_url, entry)
+            return entry['definitions']
+
+    def clear(self):
+        """
+        Delete all saved definitions
+        :return: None
+        """
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.startswith('help_'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+def configure_help_cache(**kwargs):
+    """
+    Replace the shared /help cache (see HelpCache for keyword arguments)
+    :return: HelpCache
+    """
+    global _help_cache
+    with _lock:
+        _help_cache = HelpCache(**kwargs)
+    return _help_cache
+
+
+def get_help_cache():
+    """
+    Get the shared /help cache, creating it on first use
+    :return: HelpCache
+    """
+    global _help_cache
+    if _help_cache is None:
+        with _lock:
+            if _help_cache is None:
+                _help_cache = HelpCache()
+    return _help_cache
+
+
+def get_input_definitions(api_url, API_KEY, help_cache=None, refresh=False):
+    """
+    Get the /help input definitions for api_url, from the cache when possible
+    :param api_url:
+    :param API_KEY:
+    :param help_cache: HelpCache to use. Default is the shared cache (see configure_help_cache).
+    :param refresh: if True, revalidate saved definitions even if they are younger than the cache's ttl
+    :return: nested_input_definitions from help endpoint
+    """
+    if help_cache is None:
+        help_cache = get_help_cache()
+    return help_cache.get(api_url, API_KEY, refresh=refresh)
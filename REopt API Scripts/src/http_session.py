@@ -0,0 +1,132 @@
+"""
+Shared requests.Session with a keep-alive connection pool, used for all calls to the REopt API from src/.
+
+Reusing one session means that polling a results URL every few seconds, or running a large batch, reuses open TCP/TLS
+connections to the API host instead of doing a new handshake for every request.
+
+Use configure_session to tune the pool before starting a batch, e.g.:
+    configure_session(pool_connections=4, pool_maxsize=50)
+
+All requests made through the shared session also go through one src.rate_limiter.RateLimiter, which can be tuned
+with configure_rate_limit, e.g.:
+    configure_rate_limit(requests_per_second=2, burst=5)
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from src.logger import log
+from src.rate_limiter import RateLimiter
+
+# number of per-host connection pools to keep (one per API host that is called)
+POOL_CONNECTIONS = 10
+# maximum number of open connections kept alive for each host
+POOL_MAXSIZE = 20
+# if True, requests wait for a free connection when all POOL_MAXSIZE connections to a host are in use, instead of
+# opening (and then discarding) extra connections
+POOL_BLOCK = False
+
+_session = None
+_session_settings = {}
+_lock = threading.Lock()
+_rate_limiter = RateLimiter()
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests.Session that waits for the rate limiter before every request and retries 429/503 responses after the
+    API's Retry-After time.
+    """
+
+    def __init__(self, rate_limiter=None):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = self.rate_limiter if self.rate_limiter is not None else _rate_limiter
+        attempt = 0
+        while True:
+            limiter.acquire()
+            resp = super().request(method, url, *args, **kwargs)
+            limiter.update_from_response(resp)
+            if not limiter.retry_after(resp, attempt):
+                return resp
+            attempt += 1
+
+
+def make_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=POOL_BLOCK,
+                 max_retries=0, rate_limiter=None):
+    """
+    Create a requests.Session with connection pooling for http and https
+    :param pool_connections: number of per-host connection pools to cache
+    :param pool_maxsize: maximum number of connections to keep alive for each host
+    :param pool_block: if True, wait for a free connection when a host's pool is exhausted
+    :param max_retries: number of retries for failed connections (passed to requests' HTTPAdapter)
+    :param rate_limiter: src.rate_limiter.RateLimiter for this session. Default is the limiter shared by all sessions.
+    :return: requests.Session
+    """
+    session = RateLimitedSession(rate_limiter=rate_limiter)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block,
+                          max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure_session(**kwargs):
+    """
+    Replace the shared session with one built with new pool settings (see make_session for keyword arguments).
+    Settings are kept for sessions created later, e.g. after close_session.
+    :return: requests.Session
+    """
+    global _session
+    with _lock:
+        _session_settings.update(kwargs)
+        old_session = _session
+        _session = make_session(**_session_settings)
+    if old_session is not None:
+        old_session.close()
+    log.debug("Configured shared HTTP session with {}.".format(_session_settings))
+    return _session
+
+
+def configure_rate_limit(**kwargs):
+    """
+    Replace the rate limiter shared by all sessions (see src.rate_limiter.RateLimiter for keyword arguments)
+    :return: src.rate_limiter.RateLimiter
+    """
+    global _rate_limiter
+    _rate_limiter = RateLimiter(**kwargs)
+    return _rate_limiter
+
+
+def get_rate_limiter():
+    """
+    :return: the rate limiter shared by all sessions
+    """
+    return _rate_limiter
+
+
+def get_session():
+    """
+    Get the shared session, creating it on first use
+    :return: requests.Session
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = make_session(**_session_settings)
+    return _session
+
+
+def close_session():
+    """
+    Close all pooled connections of the shared session. A new session is created on the next call to get_session.
+    :return: None
+    """
+    global _session
+    with _lock:
+        old_session = _session
+        _session = None
+    if old_session is not None:
+        old_session.close()
@@ -0,0 +1,134 @@
+"""
+Compiled version of make_nested_dict for building many posts from one input csv.
+
+make_nested_dict deep copies and walks the whole /help tree for every row. InputPlan walks it once, for the csv's
+columns, and records:
+ - a skeleton post with every input set to its default (inputs without a default are left out, unless a column can
+   fill them in, in which case a placeholder keeps their place in the key order)
+ - a slot for each input that a column fills in: its path in the post, the column, and whether it has a default
+Each post is then a fast copy of the skeleton with the slots filled in from the row. Null checks and numpy to python
+type conversion are done once per column for the whole DataFrame instead of once per cell.
+
+The posts are identical to those from make_nested_dict(row, copy.deepcopy(input_definitions)), including key order.
+
+Example:
+    plan = InputPlan(input_definitions, df.columns)
+    for post in plan.iter_posts(df):
+        ...
+"""
+import json
+from src.logger import log
+
+NO_DEFAULT = object()
+
+
+class InputSlot:
+    """
+    An input that a csv column fills in
+    """
+
+    def __init__(self, path, column, default, parent=None):
+        """
+        :param path: tuple of keys from the top of the post to the input, eg. ('Scenario', 'Site', 'PV', 'max_kw')
+        :param column: name of the csv column with the input's values
+        :param default: the input's default, or NO_DEFAULT if the input is left out of the post for empty cells
+        :param parent: index of the slot whose default contains this input (for dict defaults), or None
+        """
+        self.path = path
+        self.column = column
+        self.default = default
+        self.parent = parent
+
+
+class InputPlan:
+    """
+    /help input definitions compiled for the columns of an input csv
+    """
+
+    def __init__(self, input_definitions, columns):
+        """
+        :param input_definitions: nested_input_definitions from help endpoint
+        :param columns: column names of the input csv (plain input names or Obj|input)
+        """
+        self.columns = set(columns)
+        self.slots = []
+        skeleton = json.loads(json.dumps(input_definitions))
+        self.compile(skeleton, obj=None, path=(), parent=None)
+        self.skeleton = json.dumps(skeleton)
+        log.debug("Compiled input plan with {} csv inputs.".format(len(self.slots)))
+
+    def column_for(self, k, obj):
+        """
+        :return: the column that fills in input k of object obj (a plain column takes precedence over Obj|k), or None
+        """
+        if k in self.columns:
+            return k
+        if isinstance(obj, str) and obj + '|' + k in self.columns:
+            return obj + '|' + k
+        return None
+
+    def compile(self, nested_dict, obj, path, parent):
+        """
+        Walk the definitions like make_nested_dict, setting defaults in place and recording slots
+        """
+        for k, v in list(nested_dict.items()):
+
+            slot_idx = parent
+            if k[0].islower() and isinstance(v, dict):  # then this key represents an input value
+                if k == 'tilt':  # tilt default is "Site latitude" and is set to such in the api
+                    default = NO_DEFAULT
+                else:
+                    default = v.get('default', NO_DEFAULT)
+                if default is NO_DEFAULT:
+                    log.debug("No default value exists for {}.".format(k))
+
+                column = self.column_for(k, obj)
+                if column is not None:
+                    self.slots.append(InputSlot(path + (k,), column, default, parent=parent))
+                    slot_idx = len(self.slots) - 1
+                    nested_dict[k] = None if default is NO_DEFAULT else default  # placeholder keeps the key order
+                elif default is NO_DEFAULT:
+                    del nested_dict[k]
+                else:
+                    nested_dict[k] = default
+
+            if k in nested_dict.keys() and isinstance(nested_dict[k], dict):
+                if any([isinstance(i, dict) for i in nested_dict[k].values()]):  # nested dict with definitions
+                    self.compile(nested_dict[k], obj=str(k), path=path + (k,), parent=slot_idx)
+
+    def column_values(self, df):
+        """
+        :param df: input csv DataFrame
+        :return: dict of column: list of values (python types, None for empty cells) for every column used by a slot
+        """
+        values = dict()
+        for column in set(slot.column for slot in self.slots):
+            col = df[column]
+            values[column] = [None if null else v for v, null in zip(col.tolist(), col.isnull().tolist())]
+        return values
+
+    def iter_posts(self, df):
+        """
+        :param df: input csv DataFrame, with the columns that the plan was compiled for
+        :return: generator of one post per row of df
+        """
+        column_values = self.column_values(df)
+        slot_values = [(slot, column_values[slot.column]) for slot in self.slots]
+
+        for i in range(len(df)):
+            post = json.loads(self.skeleton)  # much faster than copy.deepcopy
+            overridden = set()
+            for idx, (slot, col) in enumerate(slot_values):
+                if slot.parent is not None and slot.parent in overridden:
+                    continue  # inside a dict default that this row replaced
+                container = post
+                for k in slot.path[:-1]:
+                    container = container[k]
+                v = col[i]
+                if v is None:
+                    if slot.default is NO_DEFAULT:
+                        del container[slot.path[-1]]
+                else:
+                    container[slot.path[-1]] = v
+                    overridden.add(idx)
+            yield post
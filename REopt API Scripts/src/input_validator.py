@@ -0,0 +1,237 @@
+"""
+Checking posts against the /help input definitions before they are submitted.
+
+InputValidator compiles the definitions once into a rule per input (type, min, max, required, restrict_to) and then
+checks a whole batch of posts one input at a time: the input's values are gathered from every post and numeric bounds
+are checked with numpy. Every problem in the batch is reported at once, with the row (index of the post in the batch)
+and the piped key ("Obj|field"), so bad rows can be fixed or left out before any of them use API capacity.
+
+Required inputs of a nested object are only checked if the object is in the post (eg. a v2 post without
+Scenario -> Site -> PV needs no PV inputs, and a v3 post without PV or CHP needs no PV or CHP inputs). Only Site (v3),
+Scenario -> Site (v2) and objects that are defined as required must be in every post: their required inputs (eg.
+Site|latitude) are reported as missing even if the whole object is missing from the post.
+
+Example:
+    validator = InputValidator(get_input_definitions(api_url, API_KEY))
+    errors = validator.validate(posts)
+    validator.log_errors(errors)
+    results = get_api_results_batch(posts, API_KEY, api_url, validator=validator)  # skips the invalid posts
+"""
+import math
+import numpy as np
+from src.logger import log
+
+MISSING = object()
+REQUIRED_OBJECTS = {('Site',), ('Scenario',), ('Scenario', 'Site')}  # v3 Site, and v2 Scenario -> Site
+
+TYPE_CHECKS = {
+    'float': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'int': lambda v: (isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, float) and v.is_integer()),
+    'bool': lambda v: isinstance(v, bool) or v in (0, 1),
+    'str': lambda v: isinstance(v, str),
+    'dict': lambda v: isinstance(v, dict),
+    'list': lambda v: isinstance(v, list),
+}
+
+
+def type_matches(value, type_name):
+    """
+    :param value: input value
+    :param type_name: type from the /help definitions, eg. 'float', 'list_of_float' or 'list_of_list'
+    :return: True if value is of the type (or the type is not known here)
+    """
+    if type_name.startswith('list_of_'):
+        if not isinstance(value, list):
+            return False
+        element_check = TYPE_CHECKS.get(type_name[len('list_of_'):])
+        return element_check is None or all(element_check(v) for v in value)
+    check = TYPE_CHECKS.get(type_name)
+    return check is None or check(value)
+
+
+class FieldRule:
+    """
+    Checks for one input, compiled from its /help definition
+    """
+
+    def __init__(self, path, definition):
+        """
+        :param path: tuple of keys from the top of the post to the input, eg. ('PV', 'max_kw')
+        :param definition: the input's /help definition
+        """
+        self.path = path
+        objects = [k for k in path[:-1] if k not in ('Scenario',)]
+        self.key = '|'.join(objects[-1:] + [path[-1]])
+        types = definition.get('type', [])
+        self.types = [types] if isinstance(types, str) else list(types)
+        self.min = definition.get('min')
+        self.max = definition.get('max')
+        self.required = definition.get('required', False) is True
+        self.restrict_to = definition.get('restrict_to')
+        if self.restrict_to is not None and not isinstance(self.restrict_to, (list, tuple)):
+            self.restrict_to = [self.restrict_to]
+
+
+class InputValidator:
+    """
+    /help input definitions compiled into rules for validating posts
+    """
+
+    def __init__(self, input_definitions, check_unknown=False):
+        """
+        :param input_definitions: nested_input_definitions from help endpoint
+        :param check_unknown: if True, also report inputs that are not in the definitions (eg. misspelled keys)
+        """
+        self.rules = []
+        self.object_paths = set()
+        self.required_objects = set()  # paths of objects that must be in every post
+        self.check_unknown = check_unknown
+        self.compile(input_definitions, path=())
+
+    def compile(self, definitions, path):
+        self.object_paths.add(path)
+        if path in REQUIRED_OBJECTS or definitions.get('required') is True:
+            self.required_objects.add(path)
+        for k, v in definitions.items():
+            if not isinstance(v, dict):
+                continue
+            if k[0].isupper():
+                self.compile(v, path + (k,))
+            elif 'type' in v:
+                self.rules.append(FieldRule(path + (k,), v))
+
+    def validate(self, posts):
+        """
+        :param posts: list of posts
+        :return: list of errors, each a dict with row (index of the post), key, value and message
+        """
+        posts = list(posts)
+        errors = []
+        objects = dict()  # object path: list of the object in each post (or None)
+
+        def get_objects(path):
+            if path not in objects:
+                if path == ():
+                    objects[path] = posts
+                else:
+                    objects[path] = [obj.get(path[-1]) if isinstance(obj, dict) else None
+                                     for obj in get_objects(path[:-1])]
+            return objects[path]
+
+        def error(row, rule, value, message):
+            errors.append({'row': row, 'key': rule.key, 'value': value, 'message': message})
+
+        for rule in self.rules:
+            parents = get_objects(rule.path[:-1])
+            numbers, number_rows = [], []
+            for row, parent in enumerate(parents):
+                if not isinstance(parent, dict):
+                    if rule.required and self.must_have(rule.path[:-1], row, get_objects):
+                        error(row, rule, None, "required input is missing ({} is missing)".format(
+                            '|'.join(rule.path[:-1])))
+                    continue
+                value = parent.get(rule.path[-1], MISSING)
+                if value is MISSING or value is None:
+                    if rule.required:
+                        error(row, rule, None, "required input is missing")
+                    continue
+                if rule.types and not any(type_matches(value, t) for t in rule.types):
+                    error(row, rule, value, "expected {}".format(' or '.join(rule.types)))
+                    continue
+                if isinstance(value, float) and math.isnan(value):
+                    error(row, rule, value, "value is NaN")
+                    continue
+                if rule.restrict_to is not None:
+                    bad = [v for v in (value if isinstance(value, list) else [value]) if v not in rule.restrict_to]
+                    if bad:
+                        error(row, rule, value, "{} not in {}".format(bad[0], rule.restrict_to))
+                        continue
+                if rule.min is not None or rule.max is not None:
+                    if isinstance(value, list):
+                        self.check_list_bounds(row, rule, value, error)
+                    elif isinstance(value, (int, float)):
+                        numbers.append(value)
+                        number_rows.append(row)
+
+            if numbers:  # bounds of scalar inputs, for the whole batch at once
+                values = np.asarray(numbers, dtype=float)
+                out_of_bounds = np.zeros(len(values), dtype=bool)
+                if rule.min is not None:
+                    out_of_bounds |= values < rule.min
+                if rule.max is not None:
+                    out_of_bounds |= values > rule.max
+                for i in np.flatnonzero(out_of_bounds):
+                    error(number_rows[i], rule, numbers[i], "outside of [{}, {}]".format(rule.min, rule.max))
+
+        if self.check_unknown:
+            known = set(rule.path for rule in self.rules) | self.object_paths
+            for row, post in enumerate(posts):
+                self.check_unknown_keys(row, post, (), known, errors)
+
+        errors.sort(key=lambda e: e['row'])
+        return errors
+
+    def must_have(self, object_path, row, get_objects):
+        """
+        :return: True if every object on object_path that is missing from the post must be in every post
+        """
+        for i in range(len(object_path), 0, -1):
+            if isinstance(get_objects(object_path[:i - 1])[row], dict):  # the parent of object_path[:i] is in the post
+                return all(object_path[:j] in self.required_objects for j in range(i, len(object_path) + 1))
+        return False
+
+    @staticmethod
+    def check_list_bounds(row, rule, value, error):
+        try:
+            values = np.asarray(value, dtype=float)
+        except (TypeError, ValueError):
+            return
+        if values.size == 0:
+            return
+        if np.isnan(values).any():
+            error(row, rule, None, "list contains NaN")
+        elif rule.min is not None and values.min() < rule.min:
+            error(row, rule, float(values.min()), "list value outside of [{}, {}]".format(rule.min, rule.max))
+        elif rule.max is not None and values.max() > rule.max:
+            error(row, rule, float(values.max()), "list value outside of [{}, {}]".format(rule.min, rule.max))
+
+    def check_unknown_keys(self, row, d, path, known, errors):
+        for k, v in d.items():
+            if path + (k,) not in known:
+                errors.append({'row': row, 'key': '|'.join((path + (k,))[-2:]), 'value': None,
+                               'message': "unknown input"})
+            elif isinstance(v, dict) and path + (k,) in self.object_paths:
+                self.check_unknown_keys(row, v, path + (k,), known, errors)
+
+    def validate_post(self, post):
+        """
+        Raise ValueError if a single post is invalid
+        :param post:
+        :return: None
+        """
+        errors = self.validate([post])
+        if errors:
+            raise ValueError("Invalid post: " + "; ".join(
+                "{} {}".format(e['key'], e['message']) for e in errors))
+
+    def split(self, posts):
+        """
+        :param posts: list of posts
+        :return: (valid_rows, errors), where valid_rows is a list of the indices of the posts without errors
+        """
+        posts = list(posts)
+        errors = self.validate(posts)
+        bad_rows = set(e['row'] for e in errors)
+        return [i for i in range(len(posts)) if i not in bad_rows], errors
+
+    @staticmethod
+    def log_errors(errors):
+        """
+        Log every error, and the number of invalid posts
+        :param errors: list of errors from validate
+        :return: None
+        """
+        for e in errors:
+            log.error("Post {}: {} = {!r}: {}.".format(e['row'] + 1, e['key'], e['value'], e['message']))
+        if errors:
+            log.error("{} invalid posts.".format(len(set(e['row'] for e in errors))))
@@ -0,0 +1,138 @@
+"""
+SQLite-backed ledger of submitted REopt API jobs.
+
+Each scenario is identified by a hash of its post (and the API version it was posted to) and the ledger records its
+run_uuid, submit time, status and results file. get_api_results and get_api_results_batch use it to resume polling
+runs that were in flight when a script or notebook kernel died, and to skip runs that already have saved results,
+instead of POSTing every scenario again.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+IN_FLIGHT_STATUSES = ["submitted", "Optimizing..."]
+
+
+def api_version(api_url):
+    """
+    Normalize api_url (eg. 'https://developer.nrel.gov/api/reopt/stable') so that the same API is identified by the
+    same string whether or not it has a trailing slash or query string.
+    :param api_url:
+    :return: str
+    """
+    return api_url.split('?')[0].rstrip('/')
+
+
+def hash_post(post, api_url=''):
+    """
+    Canonical hash of a post: keys are sorted and whitespace is removed before hashing, so the same scenario gets the
+    same hash regardless of key order or how it was loaded.
+    :param post: dictionary to post to the API
+    :param api_url: included in the hash so that the same post to different API versions is a different job
+    :return: sha256 hex digest
+    """
+    canonical = json.dumps(post, sort_keys=True, separators=(',', ':'), default=str)
+    h = hashlib.sha256(api_version(api_url).encode())
+    h.update(b'\n')
+    h.update(canonical.encode())
+    return h.hexdigest()
+
+
+class JobLedger:
+    """
+    Persistent record of jobs, one row per input hash. Safe to share between threads.
+    """
+
+    def __init__(self, path='job_ledger.sqlite'):
+        """
+        :param path: path to the SQLite database file, created if it does not exist
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    input_hash TEXT PRIMARY KEY,
+                    api_url TEXT,
+                    run_uuid TEXT,
+                    submit_time REAL,
+                    status TEXT,
+                    results_file TEXT,
+                    updated_time REAL
+                )"""
+            )
+
+    def get(self, input_hash):
+        """
+        :param input_hash: from hash_post
+        :return: dict of the job's columns, or None if the job is not in the ledger
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE input_hash = ?", (input_hash,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def record_submit(self, input_hash, api_url, run_uuid, results_file=None):
+        """
+        Record a newly POSTed job (replacing any earlier run of the same input hash)
+        :return: None
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (input_hash, api_version(api_url), run_uuid, now, "submitted", results_file, now)
+            )
+
+    def record_status(self, input_hash, status, results_file=None):
+        """
+        Update the status (and results_file, if given) of a job. A None status (eg. the poller gave up on a response
+        without a status) is not recorded, so that the job stays in flight and is polled again on the next run.
+        :return: None
+        """
+        if status is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, results_file = COALESCE(?, results_file), updated_time = ? "
+                "WHERE input_hash = ?",
+                (status, results_file, time.time(), input_hash)
+            )
+
+    def jobs(self, statuses=None):
+        """
+        :param statuses: optional list of statuses to filter on
+        :return: list of job dicts
+        """
+        query = "SELECT * FROM jobs"
+        params = ()
+        if statuses is not None:
+            query += " WHERE status IN ({})".format(", ".join("?" * len(statuses)))
+            params = tuple(statuses)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY submit_time", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def in_flight(self):
+        """
+        :return: list of job dicts that were submitted but have no final status yet
+        """
+        return [job for job in self.jobs() if job["status"] is None or job["status"] in IN_FLIGHT_STATUSES]
+
+    @staticmethod
+    def is_complete(job):
+        """
+        :param job: job dict from the ledger
+        :return: True if the job has a final status and its results file still exists
+        """
+        return (job is not None and job["status"] is not None and job["status"] not in IN_FLIGHT_STATUSES
+                and job["results_file"] is not None and os.path.isfile(job["results_file"]))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
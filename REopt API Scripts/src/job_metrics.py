@@ -0,0 +1,160 @@
+"""
+Structured per-job timing for batches of REopt API runs.
+
+Every job run through get_api_results (or the batch runners) with a JobMetrics object gets one record with:
+    submit_seconds       time to POST the job and get a run_uuid
+    queue_solve_seconds  time from the end of the POST (or the start of polling a resumed run) to the first poll with a
+                         status other than "Optimizing..."
+    n_polls              number of GETs of the results URL
+    download_bytes       size of the final response
+    download_seconds     time to GET the final response
+    save_seconds         time to save the response to results_file
+    total_seconds        wall time of the whole job
+The parsers record per-response parse and export times as "stage" records. Each record is appended to the metrics file
+(JSON lines, or CSV if the file name ends in .csv) as soon as it is complete, and summary() gives percentiles of every
+timing at the end of a batch, for sizing concurrency and spotting slow API periods.
+"""
+import csv
+import json
+import threading
+import time
+from src.logger import log
+
+CSV_FIELDS = ['kind', 'stage', 'run_uuid', 'results_file', 'source', 'status', 'start_time', 'submit_seconds',
+              'queue_solve_seconds', 'n_polls', 'download_bytes', 'download_seconds', 'save_seconds', 'seconds',
+              'total_seconds']
+JOB_TIMINGS = ['submit_seconds', 'queue_solve_seconds', 'n_polls', 'download_bytes', 'download_seconds',
+               'save_seconds', 'total_seconds']
+
+
+def percentile(sorted_values, q):
+    """
+    :param sorted_values: sorted list of numbers
+    :param q: percentile, 0 to 100
+    :return: linearly interpolated percentile
+    """
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def describe(values):
+    """
+    :param values: list of numbers
+    :return: dict of count, mean, p50, p90, p99 and max
+    """
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+class JobMetrics:
+    """
+    Collects timing records and appends them to a metrics file. Safe to share between threads.
+    """
+
+    def __init__(self, metrics_file='job_metrics.jsonl'):
+        """
+        :param metrics_file: path to append records to (JSON lines, or CSV if it ends in .csv). None to keep records in
+            memory only.
+        """
+        self.metrics_file = metrics_file
+        self.records = []
+        self._lock = threading.Lock()
+        self._csv_header_written = False
+
+    def start_job(self, **fields):
+        """
+        :param fields: initial fields of the record, eg. results_file
+        :return: record dict to fill in while the job runs and then pass to finish
+        """
+        record = dict(kind='job', start_time=time.time())
+        record.update(fields)
+        return record
+
+    def finish(self, record):
+        """
+        Set total_seconds of a job record and append it
+        :param record: dict from start_job
+        :return: None
+        """
+        record['total_seconds'] = time.time() - record['start_time']
+        self.append(record)
+
+    def record_stage(self, stage, seconds, **fields):
+        """
+        Append a timing for a processing stage, eg. parsing or exporting one response
+        :param stage: name of the stage, eg. 'csv_parse'
+        :param seconds: time taken
+        :param fields: other fields, eg. run_uuid
+        :return: None
+        """
+        record = dict(kind='stage', stage=stage, seconds=seconds)
+        record.update(fields)
+        self.append(record)
+
+    def append(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.metrics_file is None:
+                return
+            if self.metrics_file.endswith('.csv'):
+                with open(self.metrics_file, 'a', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+                    if not self._csv_header_written and f.tell() == 0:
+                        writer.writeheader()
+                    self._csv_header_written = True
+                    writer.writerow(record)
+            else:
+                with open(self.metrics_file, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """
+        :return: dict with the number of jobs, jobs per hour, the count of each source and status, and percentiles of
+            each job timing and of each stage's seconds
+        """
+        with self._lock:
+            records = list(self.records)
+        jobs = [r for r in records if r['kind'] == 'job']
+        summary = {'n_jobs': len(jobs)}
+        if jobs:
+            start = min(r['start_time'] for r in jobs)
+            end = max(r['start_time'] + r.get('total_seconds', 0) for r in jobs)
+            summary['wall_seconds'] = end - start
+            summary['jobs_per_hour'] = 3600.0 * len(jobs) / (end - start) if end > start else None
+            for field in ['source', 'status']:
+                counts = dict()
+                for r in jobs:
+                    counts[str(r.get(field))] = counts.get(str(r.get(field)), 0) + 1
+                summary[field] = counts
+            for field in JOB_TIMINGS:
+                values = [r[field] for r in jobs if r.get(field) is not None]
+                if values:
+                    summary[field] = describe(values)
+        for stage in sorted(set(r['stage'] for r in records if r['kind'] == 'stage')):
+            summary[stage + '_seconds'] = describe([r['seconds'] for r in records if r.get('stage') == stage])
+        return summary
+
+    def log_summary(self):
+        """
+        Log the summary (see summary) and return it
+        :return: dict
+        """
+        summary = self.summary()
+        log.info("Job metrics: {} jobs in {:.0f}s, sources {}, statuses {}.".format(
+            summary['n_jobs'], summary.get('wall_seconds', 0), summary.get('source'), summary.get('status')))
+        for k, v in summary.items():
+            if isinstance(v, dict) and 'p50' in v:
+                log.info("  {:<22} n={:<6} mean={:<10.3g} p50={:<10.3g} p90={:<10.3g} p99={:<10.3g} max={:.3g}".format(
+                    k, v['count'], v['mean'], v['p50'], v['p90'], v['p99'], v['max']))
+        return summary
@@ -0,0 +1,141 @@
+"""
+Binary store of load profiles, so that custom load profile csv files are parsed once instead of once per site and run.
+
+Profiles are appended as little-endian float64 to one data file, with a JSON index of each profile's source csv path,
+size and modification time, and its offset and length in the data file. Reading a profile returns a read-only view of
+the memory-mapped data file, without copying or parsing. A profile is re-ingested if its csv file changes.
+
+Example, from the "REopt API Scripts" directory:
+    store = LoadProfileStore()
+    store.ingest_directory('load_profiles')  # optional, profiles are also ingested the first time they are read
+    loads_kw = store.get('load_profiles/site3_8760_loads_kw.csv')  # numpy array
+or from the command line:
+    python -m src.load_profile_store load_profiles
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from src.logger import log
+
+VALID_LENGTHS = [8760, 17520, 35040]  # hourly, 30 minute and 15 minute profiles
+DTYPE = np.dtype('<f8')
+
+
+class LoadProfileStore:
+    """
+    Memory-mapped float64 load profiles with a JSON index. Safe to share between threads.
+    """
+
+    def __init__(self, store_dir='.reopt_cache/load_profiles'):
+        """
+        :param store_dir: directory for the data and index files, created if it does not exist
+        """
+        self.store_dir = store_dir
+        self.data_file = os.path.join(store_dir, 'profiles.f64')
+        self.index_file = os.path.join(store_dir, 'index.json')
+        self._lock = threading.Lock()
+        self._data = None  # memory map of the data file
+        os.makedirs(store_dir, exist_ok=True)
+        try:
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)  # csv path: {"size", "mtime", "offset", "length"}
+        except (OSError, ValueError):
+            self.index = dict()
+
+    @staticmethod
+    def key(fp):
+        return os.path.abspath(fp)
+
+    def is_current(self, fp):
+        """
+        :return: True if the csv file fp is in the store and has not changed since it was ingested
+        """
+        entry = self.index.get(self.key(fp))
+        if entry is None:
+            return False
+        stat = os.stat(fp)
+        return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    def ingest(self, fp):
+        """
+        Parse and check a load profile csv file (one column of values, no header) and append it to the store
+        :param fp: path to the load profile csv file
+        :return: None
+        """
+        with self._lock:
+            if self.is_current(fp):
+                return
+            load_profile = pd.read_csv(fp, header=None).iloc[:, 0].to_numpy(dtype=DTYPE)
+            assert len(load_profile) in VALID_LENGTHS
+            stat = os.stat(fp)
+            with open(self.data_file, 'ab') as f:
+                offset = f.tell() // DTYPE.itemsize
+                f.write(load_profile.tobytes())
+            self.index[self.key(fp)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'offset': offset,
+                                        'length': len(load_profile)}
+            self._data = None  # the data file grew, so map it again on the next read
+            tmp = self.index_file + '.tmp{}'.format(threading.get_ident())
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_file)
+        log.debug("Added load profile {} to {}".format(fp, self.store_dir))
+
+    def ingest_directory(self, path_to_load_files):
+        """
+        Ingest every csv file in a directory
+        :param path_to_load_files: directory of load profile csv files
+        :return: number of profiles in the directory
+        """
+        files = sorted(glob.glob(os.path.join(path_to_load_files, '*.csv')))
+        for fp in files:
+            self.ingest(fp)
+        log.info("{} load profiles from {} are in {}".format(len(files), path_to_load_files, self.store_dir))
+        return len(files)
+
+    def get(self, fp):
+        """
+        :param fp: path to a load profile csv file, which is ingested first if it is new or has changed
+        :return: read-only numpy array of the load profile in kW
+        """
+        if not self.is_current(fp):
+            self.ingest(fp)
+        with self._lock:
+            entry = self.index[self.key(fp)]
+            if self._data is None:
+                self._data = np.memmap(self.data_file, dtype=DTYPE, mode='r')
+            return self._data[entry['offset']:entry['offset'] + entry['length']]
+
+    def compact(self):
+        """
+        Rewrite the data file with only the current version of each profile (changed profiles leave their old
+        values in the data file)
+        :return: None
+        """
+        with self._lock:
+            data = np.fromfile(self.data_file, dtype=DTYPE) if os.path.isfile(self.data_file) else np.zeros(0)
+            tmp = self.data_file + '.tmp{}'.format(threading.get_ident())
+            offset = 0
+            with open(tmp, 'wb') as f:
+                for entry in self.index.values():
+                    f.write(data[entry['offset']:entry['offset'] + entry['length']].tobytes())
+                    entry['offset'] = offset
+                    offset += entry['length']
+            self._data = None
+            os.replace(tmp, self.data_file)
+            with open(self.index_file, 'w') as f:
+                json.dump(self.index, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingest load profile csv files into a binary load profile store.")
+    parser.add_argument('path_to_load_files', nargs='+', help="directories of load profile csv files")
+    parser.add_argument('--store-dir', default='.reopt_cache/load_profiles')
+    args = parser.parse_args()
+
+    store = LoadProfileStore(args.store_dir)
+    for path in args.path_to_load_files:
+        store.ingest_directory(path)
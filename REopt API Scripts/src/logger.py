@@ -11,21 +11,27 @@ WARNING	    30
 INFO	    20
 DEBUG	    10
 NOTSET	    0
+
+Processes started by a process pool (eg. src.output_extractor and src.bulk_results_parser with the spawn start method)
+import this module again. Only the main process writes main.log, so that they do not truncate it; their log records go
+to the console.
 """
 import logging
+import multiprocessing
 
 log = logging.getLogger('main')
 log.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler(filename='main.log', mode='w')
-file_formatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-file_handler.setFormatter(file_formatter)
-file_handler.setLevel(logging.INFO)
+if multiprocessing.current_process().name == 'MainProcess':  # not a worker; mode 'w' truncates main.log
+    file_handler = logging.FileHandler(filename='main.log', mode='w')
+    file_formatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+    file_handler.setFormatter(file_formatter)
+    file_handler.setLevel(logging.INFO)
+    log.addHandler(file_handler)
 
 console_handler = logging.StreamHandler()
 console_formatter = logging.Formatter('%(name)-12s %(levelname)-8s %(message)s')
 console_handler.setFormatter(console_formatter)
 console_handler.setLevel(logging.INFO)
 
-log.addHandler(file_handler)
 log.addHandler(console_handler)
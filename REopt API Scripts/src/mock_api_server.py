@@ -0,0 +1,273 @@
+"""
+Lightweight local stand-in for the REopt API, for offline testing and measuring how batch runs scale.
+
+Implements:
+ - POST <api_url>/job/                    returns {"run_uuid": ...}
+ - GET  <api_url>/job/<run_uuid>/results/  returns "Optimizing..." until the run's solve time has passed, then a canned
+                                           response (eg. outputs/results_file.json) with the run's run_uuid
+ - GET  <api_url>/help                     input definitions, built from the canned response's inputs or loaded from
+                                           a saved /help response, with an ETag (304 for a matching If-None-Match)
+The solve latency, the fraction of POSTs and runs that fail, and a requests-per-second limit (answered with 429 and a
+Retry-After header) are configurable.
+
+Example, from the "REopt API Scripts" directory:
+    from src.mock_api_server import start_mock_api_server
+    server, api_url = start_mock_api_server(solve_seconds=(1, 5))
+    results = get_api_results(post_1, API_KEY="DEMO_KEY", api_url=api_url, results_file="outputs/test.json")
+    server.shutdown()
+or from the command line:
+    python -m src.mock_api_server --port 8000 --solve-seconds 2 10
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from src.logger import log
+from src.results_storage import load_results
+
+DEFAULT_RESPONSES = [os.path.join(os.path.dirname(__file__), '..', 'outputs', 'results_file.json')]
+
+results_path_regex = re.compile(r'/job/([^/]+)/results/?$')
+
+
+def make_help_definitions(response):
+    """
+    Build /help style input definitions from the inputs of a canned response, using each input's value as its default
+    :param response: API response (v3 or v2 shape)
+    :return: nested dict of definitions, eg. {"Site": {"latitude": {"type": "float", "default": 34.5}}}
+    """
+    def definitions(inputs):
+        defs = dict()
+        for k, v in inputs.items():
+            if k[0].isupper() and isinstance(v, dict):
+                defs[k] = definitions(v)
+            elif isinstance(v, dict):
+                defs[k] = {"type": "dict"}
+            elif isinstance(v, list):
+                defs[k] = {"type": "list_of_float"}  # no default for arrays like loads_kw
+            else:
+                defs[k] = {"type": type_name(v), "default": v}
+        return defs
+
+    return definitions(response.get('inputs', dict()))
+
+
+def type_name(value):
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    return "str"
+
+
+class MockAPI:
+    """
+    State shared by all request handlers of a mock server: canned responses, submitted jobs and error settings.
+    """
+
+    def __init__(self, responses=None, help_file=None, solve_seconds=5, post_error_rate=0, run_error_rate=0,
+                 requests_per_second=None, retry_after=1, seed=None):
+        """
+        :param responses: list of paths to saved API responses to serve as results (used round-robin)
+        :param help_file: optional path to a saved /help response. Default builds one from the first response.
+        :param solve_seconds: seconds each run is "Optimizing...": a number, or (min, max) for a uniform random time
+        :param post_error_rate: fraction of POSTs that are rejected with status 400
+        :param run_error_rate: fraction of runs that finish with status "error"
+        :param requests_per_second: if not None, requests beyond this rate get status 429 with a Retry-After header
+        :param retry_after: seconds sent in the Retry-After header of 429 responses
+        :param seed: random seed, for repeatable latencies and errors
+        """
+        self.templates = []  # (serialized response, its run_uuid as bytes, True if v3 response)
+        first_response = None
+        for fp in responses or DEFAULT_RESPONSES:
+            response = load_results(fp)
+            first_response = first_response or response
+            v3 = "status" in response
+            run_uuid = response.get("run_uuid") if v3 else response['outputs']['Scenario'].get("run_uuid")
+            run_uuid = json.dumps(run_uuid).encode() if run_uuid else None
+            self.templates.append((json.dumps(response).encode(), run_uuid, v3))
+        if help_file is not None:
+            with open(help_file, 'r') as f:
+                self.help = json.dumps(json.load(f)).encode()
+        else:
+            self.help = json.dumps(make_help_definitions(first_response)).encode()
+        self.solve_seconds = solve_seconds
+        self.post_error_rate = post_error_rate
+        self.run_error_rate = run_error_rate
+        self.requests_per_second = requests_per_second
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.jobs = dict()  # run_uuid: (time done, template index, failed)
+        self.request_times = deque()
+        self.n_requests = 0
+        self.n_throttled = 0
+        self._lock = threading.Lock()
+
+    def throttled(self):
+        """
+        :return: True if this request exceeds requests_per_second over the last second
+        """
+        with self._lock:
+            self.n_requests += 1
+            if self.requests_per_second is None:
+                return False
+            now = time.monotonic()
+            while self.request_times and self.request_times[0] < now - 1:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.requests_per_second:
+                self.n_throttled += 1
+                return True
+            self.request_times.append(now)
+            return False
+
+    def submit(self):
+        """
+        :return: (status code, response dict) for a POST to /job/
+        """
+        with self._lock:
+            if self.random.random() < self.post_error_rate:
+                return 400, {"messages": {"error": "Mock input error."}}
+            if isinstance(self.solve_seconds, (list, tuple)):
+                solve_seconds = self.random.uniform(*self.solve_seconds)
+            else:
+                solve_seconds = self.solve_seconds
+            run_uuid = str(uuid.uuid4())
+            failed = self.random.random() < self.run_error_rate
+            self.jobs[run_uuid] = (time.monotonic() + solve_seconds, len(self.jobs) % len(self.templates), failed)
+        return 201, {"run_uuid": run_uuid}
+
+    def results(self, run_uuid):
+        """
+        :return: (status code, response dict or serialized response) for a GET of /job/<run_uuid>/results/
+        """
+        job = self.jobs.get(run_uuid)
+        if job is None:
+            return 404, {"messages": {"error": "run_uuid {} not found.".format(run_uuid)}}
+        done_time, template_idx, failed = job
+        body, template_run_uuid, v3 = self.templates[template_idx]
+
+        if time.monotonic() < done_time:
+            status = "Optimizing..."
+        elif failed:
+            status = "error"
+        elif template_run_uuid is None:
+            return 200, body
+        else:  # swap in this run's run_uuid without decoding the canned response
+            return 200, body.replace(template_run_uuid, json.dumps(run_uuid).encode(), 1)
+
+        if v3:
+            response = {"run_uuid": run_uuid, "status": status, "inputs": {}, "outputs": {}, "messages": {}}
+        else:
+            response = {"outputs": {"Scenario": {"run_uuid": run_uuid, "status": status}}, "inputs": {},
+                        "messages": {}}
+        if failed and status == "error":
+            response["messages"] = {"error": "Mock run error."}
+        return 200, response
+
+
+class MockAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so that pooled sessions can reuse connections
+
+    def log_message(self, format, *args):
+        log.debug("Mock API: " + format % args)
+
+    def send_json(self, code, body, headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or dict()).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_throttled(self):
+        self.send_json(429, {"error": {"code": "OVER_RATE_LIMIT", "message": "Mock rate limit exceeded."}},
+                       headers={'Retry-After': str(self.server.mock_api.retry_after)})
+
+    def do_GET(self):
+        api = self.server.mock_api
+        if api.throttled():
+            return self.send_throttled()
+        path = urlparse(self.path).path
+        if path.rstrip('/').endswith('/help'):
+            etag = '"{}"'.format(hashlib.md5(api.help).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            return self.send_json(200, api.help, headers={'ETag': etag})
+        match = results_path_regex.search(path)
+        if match:
+            return self.send_json(*api.results(match.group(1)))
+        self.send_json(404, {"messages": {"error": "Unknown path {}".format(path)}})
+
+    def do_POST(self):
+        api = self.server.mock_api
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)  # the post itself is not used
+        if api.throttled():
+            return self.send_throttled()
+        path = urlparse(self.path).path
+        if path.rstrip('/').endswith('/job'):
+            return self.send_json(*api.submit())
+        self.send_json(404, {"messages": {"error": "Unknown path {}".format(path)}})
+
+
+def start_mock_api_server(host='127.0.0.1', port=0, api_path='/stable', **kwargs):
+    """
+    Start a mock API server on a background thread
+    :param host:
+    :param port: 0 to pick a free port
+    :param api_path: path that the API is served under; use '/stable' or '/v3' for v3 responses and '/v2' for
+        archived v2 responses, so that get_api_results picks the matching poller
+    :param kwargs: passed to MockAPI (responses, help_file, solve_seconds, post_error_rate, run_error_rate,
+        requests_per_second, retry_after, seed)
+    :return: (server, api_url); call server.shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host, port), MockAPIRequestHandler)
+    server.daemon_threads = True
+    server.mock_api = MockAPI(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = 'http://{}:{}{}'.format(host, server.server_port, api_path)
+    log.info("Mock REopt API running at {}".format(api_url))
+    return server, api_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local mock of the REopt API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--api-path', default='/stable')
+    parser.add_argument('--responses', nargs='+', default=None, help="saved API responses to serve as results")
+    parser.add_argument('--help-file', default=None, help="saved /help response")
+    parser.add_argument('--solve-seconds', type=float, nargs='+', default=[5], help="seconds, or min and max seconds")
+    parser.add_argument('--post-error-rate', type=float, default=0)
+    parser.add_argument('--run-error-rate', type=float, default=0)
+    parser.add_argument('--requests-per-second', type=float, default=None)
+    parser.add_argument('--retry-after', type=float, default=1)
+    args = parser.parse_args()
+
+    solve = args.solve_seconds[0] if len(args.solve_seconds) == 1 else tuple(args.solve_seconds[:2])
+    mock_server, url = start_mock_api_server(
+        host=args.host, port=args.port, api_path=args.api_path, responses=args.responses, help_file=args.help_file,
+        solve_seconds=solve, post_error_rate=args.post_error_rate, run_error_rate=args.run_error_rate,
+        requests_per_second=args.requests_per_second, retry_after=args.retry_after
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
@@ -1,10 +1,10 @@
 import pandas as pd
 import numpy as np
 import os
-import requests
 import json
-import copy
 from src.logger import log
+from src.help_cache import get_input_definitions
+from src.input_plan import InputPlan
 
 
 def set_default(d, k):
@@ -82,68 +82,154 @@ def make_nested_dict(flat_dict, nested_dict, obj=None):
     return nested_dict
 
 
-def add_load_profile_inputs(flat_dict, nested_dict, path_to_load_files="../inputs/load_profiles"):
+def read_load_profile(fp, cache=None, store=None):
+    """
+    Read and check a custom load profile csv file (one column of values, no header)
+    :param fp: path to the load profile csv file
+    :param cache: optional dict of path: load profile, shared across sites so that each file is read and checked once
+    :param store: optional src.load_profile_store.LoadProfileStore to read the profile from instead of parsing the csv
+    :return: list of floats. Profiles from the cache are shared between sites, so do not modify them in place.
+    """
+    if cache is not None and fp in cache:
+        return cache[fp]
+    if store is not None:
+        load_profile = store.get(fp).tolist()  # checked when it was added to the store
+    else:
+        load_profile = pd.read_csv(fp, header=None, squeeze=True).tolist()
+        load_profile = [float(v) for v in load_profile]  # numpy floats are not JSON serializable
+        assert len(load_profile) in [8760, 17520, 35040]
+    if cache is not None:
+        cache[fp] = load_profile
+    return load_profile
+
+
+def read_rate_file(fp, cache=None):
+    """
+    Read a URDB rate json file
+    :param fp: path to the rate json file
+    :param cache: optional dict of path: rate, shared across sites so that each file is read once
+    :return: dict. Rates from the cache are shared between sites, so do not modify them in place.
+    """
+    if cache is not None and fp in cache:
+        return cache[fp]
+    with open(fp, "r") as f:
+        rate = json.load(f)
+    if cache is not None:
+        cache[fp] = rate
+    return rate
+
+
+def add_load_profile_inputs(flat_dict, nested_dict, path_to_load_files="../inputs/load_profiles", cache=None,
+                            store=None):
     """
     If flat_dict has a "load_file" key (i.e. same column in csv file),
     then a custom load profile is added to the inputs (which is used by API even if other optional inputs are filled
     in, such as doe_reference_name and annual_kwh)
     :param flat_dict: inputs from site(s) data csv file
     :param nested_dict: nested_dict that has already passed through make_nested_dict (filled in single value inputs)
+    :param cache: optional dict of load profiles already read (see read_load_profile)
+    :param store: optional src.load_profile_store.LoadProfileStore (see read_load_profile)
     :return: None
     """
     if "load_file" in flat_dict.keys():
         if not pd.isnull(flat_dict["load_file"]):  # case for some sites having custom load profiles
             fp = os.path.join(path_to_load_files, flat_dict["load_file"])
-            load_profile = pd.read_csv(fp, header=None, squeeze=True).tolist()
-            load_profile = [float(v) for v in load_profile]  # numpy floats are not JSON serializable
-            assert len(load_profile) in [8760, 17520, 35040]
+            load_profile = read_load_profile(fp, cache=cache, store=store)
             nested_dict['Scenario']['Site']['LoadProfile']['loads_kw'] = load_profile
     else:
         log.info("Using built-in profile for Site number {}.".format(flat_dict['site_number']))
 
 
-def multi_site_csv_parser(path_to_csv, api_url, API_KEY, n_sites=None):
+def multi_site_csv_parser(path_to_csv, api_url, API_KEY, n_sites=None, help_cache=None, start_row=0, end_row=None,
+                          load_profile_store=None):
     """
     Script to read a multi-sites input csv file and parse it into dictionaries for passing to the API.
     :param path_to_csv: path to csv file containing rows for each site and column headers.
     :param n_sites: default=None. If integer value is passed then only that many sites will be processed.
+    :param help_cache: optional src.help_cache.HelpCache for the /help definitions. Default is the shared cache.
+    :param start_row: index of the first site (row after the header) to process, starting at 0
+    :param end_row: default=None. If integer value is passed then sites from start_row up to (not including) end_row
+        are processed.
+    :param load_profile_store: optional src.load_profile_store.LoadProfileStore to read custom load profiles from
     :return: list of dictionaries, with length equal to n_sites, which can be posted to API. Additional keys may be
     added for creating output summary csv.
-    TODO: [ ] pass start row and end row for running scenarios.
     """
+    return [post for site_inputs, post in iter_multi_site_posts(path_to_csv, api_url, API_KEY, n_sites=n_sites,
+                                                                help_cache=help_cache, start_row=start_row,
+                                                                end_row=end_row, chunksize=None,
+                                                                load_profile_store=load_profile_store)]
 
-    df = pd.read_csv(path_to_csv)
 
+def read_csv_chunks(path_to_csv, start_row=0, end_row=None, chunksize=1000):
+    """
+    Read the rows start_row to end_row of a csv file, a chunk of rows at a time
+    :param path_to_csv: path to csv file with column headers
+    :param start_row: index of the first row (after the header) to read, starting at 0
+    :param end_row: index of the row (after the header) to stop before, or None to read to the end of the file
+    :param chunksize: number of rows per DataFrame, or None to read all of the rows at once
+    :return: generator of DataFrames
+    """
+    skiprows = range(1, start_row + 1) if start_row else None  # keep the header
+    nrows = None if end_row is None else max(end_row - start_row, 0)
+    if chunksize is None:
+        yield pd.read_csv(path_to_csv, skiprows=skiprows, nrows=nrows)
+    else:
+        for df in pd.read_csv(path_to_csv, skiprows=skiprows, nrows=nrows, chunksize=chunksize):
+            yield df
+
+
+def iter_multi_site_posts(path_to_csv, api_url, API_KEY, n_sites=None, help_cache=None, start_row=0, end_row=None,
+                          chunksize=1000, load_profile_store=None):
+    """
+    Generator version of multi_site_csv_parser: the csv is read a chunk of rows at a time and each site's post is built
+    only when it is needed, so that a long list of sites (and their load profiles) never has to be held in memory at
+    once.
+    The /help definitions are compiled into an InputPlan once, and each load profile and rate file is read once and
+    then shared by every site that uses it.
+    :param path_to_csv: path to csv file containing rows for each site and column headers.
+    :param n_sites: default=None. If integer value is passed then only that many sites (from start_row) will be
+        processed.
+    :param help_cache: optional src.help_cache.HelpCache for the /help definitions. Default is the shared cache.
+    :param start_row: index of the first site (row after the header) to process, starting at 0
+    :param end_row: default=None. If integer value is passed then sites from start_row up to (not including) end_row
+        are processed.
+    :param chunksize: number of csv rows to read at a time, or None to read the whole csv at once. Note that pandas
+        infers column types per chunk, so an integer column with an empty cell becomes float only in that chunk.
+    :param load_profile_store: optional src.load_profile_store.LoadProfileStore to read custom load profiles from
+    :return: generator of (site_inputs, post) for each row, where site_inputs is the row as a dict
+    """
     if isinstance(n_sites, int):
-        df = df.iloc[:n_sites]
-
-    input_definitions = json.loads(requests.get(api_url + '/help?API_KEY=' + API_KEY).content)
-    if "error" in input_definitions.keys():
-        raise BlockingIOError(input_definitions["error"])
-
-    posts = []
-    for i in range(len(df)):
-        nested_dict = copy.deepcopy(input_definitions)
-
-        site_inputs = df.iloc[i].to_dict()
-        posts.append(make_nested_dict(site_inputs, nested_dict))
-
-        path_to_load_files = "./load_profiles"
-        add_load_profile_inputs(site_inputs, posts[-1], path_to_load_files=path_to_load_files)
-        
-        path_to_rate_files = "./electric_rates"
-        if "urdb_json_file" in df.columns:
-            if pd.isnull(df.loc[i,"urdb_json_file"]) == False:
-                rate_i = json.load(open(os.path.join(path_to_rate_files, df["urdb_json_file"][i]), "r"))
-                posts[i]["Scenario"]["Site"]["ElectricTariff"]["urdb_response"] = rate_i           
+        end_row = start_row + n_sites if end_row is None else min(end_row, start_row + n_sites)
+
+    input_definitions = get_input_definitions(api_url, API_KEY, help_cache=help_cache)
+
+    plan = None
+    load_profiles = dict()  # path: load profile
+    rates = dict()  # path: urdb_response
+    for df in read_csv_chunks(path_to_csv, start_row=start_row, end_row=end_row, chunksize=chunksize):
+        if plan is None:
+            plan = InputPlan(input_definitions, df.columns)  # replaces deepcopy + make_nested_dict for every row
+
+        for site_inputs, post in zip(df.to_dict('records'), plan.iter_posts(df)):
+
+            path_to_load_files = "./load_profiles"
+            add_load_profile_inputs(site_inputs, post, path_to_load_files=path_to_load_files, cache=load_profiles,
+                                    store=load_profile_store)
+
+            path_to_rate_files = "./electric_rates"
+            if "urdb_json_file" in df.columns:
+                if pd.isnull(site_inputs["urdb_json_file"]) == False:
+                    rate_i = read_rate_file(os.path.join(path_to_rate_files, site_inputs["urdb_json_file"]),
+                                            cache=rates)
+                    post["Scenario"]["Site"]["ElectricTariff"]["urdb_response"] = rate_i
+                else:
+                    pass
             else:
                 pass
-        else:
-            pass
 
-        posts[i]['Scenario']['Site']['Wind'] = {'max_kw': 0}  # hack for Wind not in help endpoint
+            post['Scenario']['Site']['Wind'] = {'max_kw': 0}  # hack for Wind not in help endpoint
 
-    return posts
+            yield site_inputs, post
 
 
 test = False
@@ -0,0 +1,130 @@
+"""
+Sensitivity sweeps over a base post, without hand-editing scenarios.csv or copying posts in a notebook.
+
+Axes are given with the piped key convention of the input csv ("Obj|field", eg. "PV|max_kw" or
+"Financial|owner_discount_rate_fraction"):
+    grid    {key: [values]}: every combination of the values of all grid keys
+    lists   {key: [values]}: keys varied together, the i-th point using the i-th value of every list
+    lhs     {key: (min, max)}: n_samples Latin hypercube samples of continuous ranges
+and the three kinds are crossed with each other. Points are generated lazily and duplicate combinations are skipped.
+
+Each post is a copy of the base post in which only the dictionaries on the path to a swept field are copied; every
+other part of the base post (eg. loads_kw and urdb_response) is shared by reference between all of the posts, so tens
+of thousands of posts take little memory. Do not modify the posts in place.
+
+Example:
+    base_post = json.load(open('inputs/post_1.json'))
+    sweep = parameter_sweep(base_post, grid={"PV|max_kw": [0, 100, 200]},
+                            lhs={"Financial|elec_cost_escalation_rate_fraction": (0.01, 0.04)}, n_samples=10, seed=42)
+    points, posts = zip(*sweep)
+    results = get_api_results_batch(posts, API_KEY, api_url)
+"""
+import itertools
+import json
+import numpy as np
+
+
+def key_path(post, key):
+    """
+    :param post: v3 post (objects at the top level) or v2 post (objects under Scenario -> Site)
+    :param key: piped key, eg. "PV|max_kw"
+    :return: tuple of keys from the top of the post to the field, eg. ('PV', 'max_kw')
+    """
+    path = tuple(key.split('|'))
+    if 'Scenario' in post and path[0] != 'Scenario':  # v2 post
+        if path[0] == 'Site':
+            return ('Scenario',) + path
+        return ('Scenario', 'Site') + path
+    return path
+
+
+def set_fields(base_post, paths, values):
+    """
+    Copy base_post with fields set, copying only the dictionaries on the paths to the fields
+    :param base_post: dict
+    :param paths: list of key paths (see key_path)
+    :param values: list of values, one for each path
+    :return: new post, sharing all unmodified dictionaries and lists with base_post
+    """
+    post = dict(base_post)
+    copied = {id(post)}
+    for path, value in zip(paths, values):
+        d = post
+        for k in path[:-1]:
+            child = d.get(k)
+            if child is None or id(child) not in copied:
+                child = dict(child) if child is not None else dict()
+                d[k] = child
+                copied.add(id(child))
+            d = child
+        d[path[-1]] = value
+    return post
+
+
+def latin_hypercube(ranges, n_samples, seed=None):
+    """
+    :param ranges: list of (min, max), one per dimension
+    :param n_samples: number of samples
+    :param seed: random seed, for repeatable samples
+    :return: n_samples x len(ranges) array; each dimension has exactly one sample in each of n_samples equal strata
+    """
+    rng = np.random.RandomState(seed)
+    samples = np.empty((n_samples, len(ranges)))
+    for j, (low, high) in enumerate(ranges):
+        strata = (rng.permutation(n_samples) + rng.uniform(size=n_samples)) / n_samples
+        samples[:, j] = low + strata * (high - low)
+    return samples
+
+
+def sweep_points(grid=None, lists=None, lhs=None, n_samples=10, seed=None):
+    """
+    :param grid: dict of piped key: list of values
+    :param lists: dict of piped key: list of values (all lists the same length)
+    :param lhs: dict of piped key: (min, max)
+    :param n_samples: number of Latin hypercube samples
+    :param seed: random seed for the Latin hypercube samples
+    :return: generator of dicts of piped key: value
+    """
+    grid, lists, lhs = grid or dict(), lists or dict(), lhs or dict()
+    if len(set(len(v) for v in lists.values())) > 1:
+        raise ValueError("All lists must have the same length.")
+
+    axes = []  # lists and samples, which are already in memory
+    if lists:
+        axes.append([dict(zip(lists.keys(), values)) for values in zip(*lists.values())])
+    if lhs:
+        samples = latin_hypercube(list(lhs.values()), n_samples, seed=seed)
+        axes.append([dict(zip(lhs.keys(), [float(v) for v in row])) for row in samples])
+
+    for values in itertools.product(*grid.values()):  # the full factorial grid, one point at a time
+        for parts in itertools.product(*axes):
+            point = dict(zip(grid.keys(), values))
+            for part in parts:
+                point.update(part)
+            yield point
+
+
+def parameter_sweep(base_post, grid=None, lists=None, lhs=None, n_samples=10, seed=None):
+    """
+    Lazily generate posts for a sweep over a base post (see module docstring)
+    :param base_post: v3 (or v2) post to vary
+    :param grid: dict of piped key: list of values, for a full factorial sweep
+    :param lists: dict of piped key: list of values, for keys varied together
+    :param lhs: dict of piped key: (min, max), for Latin hypercube samples
+    :param n_samples: number of Latin hypercube samples
+    :param seed: random seed for the Latin hypercube samples
+    :return: generator of (point, post), where point is a dict of piped key: value
+    """
+    keys = list((grid or dict()).keys()) + list((lists or dict()).keys()) + list((lhs or dict()).keys())
+    if len(set(keys)) < len(keys):
+        raise ValueError("Each key can only be in one of grid, lists and lhs.")
+    paths = [key_path(base_post, key) for key in keys]
+
+    seen = set()
+    for point in sweep_points(grid=grid, lists=lists, lhs=lhs, n_samples=n_samples, seed=seed):
+        values = [point[key] for key in keys]
+        fingerprint = json.dumps(values, sort_keys=True, default=str)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        yield point, set_fields(base_post, paths, values)
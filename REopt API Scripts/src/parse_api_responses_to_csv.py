@@ -1,69 +1,82 @@
 import csv
-import pandas as pd
-from collections import OrderedDict
+import time
+from contextlib import ExitStack
+from src.output_extractor import OutputExtractor
+from src.summary_writer import SummaryWriter
 
 
 def get_nested_output(key, resp, obj=None):
-
-    if '|' in key:
-        obj = key[:key.index('|')]
-        val = key[key.index('|') + 1:]
-
-        return resp['outputs']['Scenario']['Site'][obj][val]
-
-    else:
-        site = {k: v for k, v in resp['outputs']['Scenario']['Site'].items() if k[0].isupper()}
-        # Site now has lower case keys that must be removed
-        for d in site.values():
-
-            if key in d.keys():
-                return d[key]
-
-    return None
+    """
+    :param key: "Obj|field" or "field" (first output object that has the field)
+    :param resp: v3 or v2 API response
+    :return: value of the output field, or None if it is not in the response
+    """
+    return OutputExtractor([key]).extract(resp)[0]
 
 
-def parse_responses_to_csv_with_template(csv_template, responses, output_csv, input_csv=None, n_custom_columns=0):
+def parse_responses_to_csv_with_template(csv_template, responses, output_csv, input_csv=None, n_custom_columns=0,
+                                         metrics=None, n_workers=1, resume=False):
     """
 
     :param csv_template: path to csv file with headers for output fields, and rows for input scenarios
-    :param responses: list of dicts, each dict is API response for input scenario (in same order is input csv)
+    :param responses: list of dicts, each dict is API response for input scenario (in same order is input csv), or
+        list of paths to saved responses (only the template's fields are read from each file, see src.result_reader)
     :param output_csv: str, path to output csv that parser writes summary to.
     :param input_csv: str, path to input csv to copy custom columns from
     :param n_custom_columns: number of custom columns to copy from input scenarios csv to output_csv
         (columns that are not modified by script)
-    :return: None (writes results to csv).
+    :param metrics: optional src.job_metrics.JobMetrics to record the time to parse each response in (stage 'csv_parse')
+    :param n_workers: number of processes to extract the outputs with (see src.output_extractor); metrics are only
+        recorded per response when n_workers is 1
+    :param resume: if True, keep the rows file of output_csv (see src.summary_writer) after a run, and on the next run
+        keep the rows in it instead of parsing those responses again. Rows are matched to responses by the
+        site_number custom column if there is one, or else by run_uuid (or path, for saved responses).
+    :return: None (writes results to csv, a row at a time).
     """
 
-    results = OrderedDict()
-
-    # open template and initialize results dict with custom cols filled in and black output columns
     with open(csv_template, 'r') as f:
         reader = csv.reader(f)
         outputs = next(reader)  # names of parameters to pull out of responses and put in output_csv
 
-    if input_csv is not None:
-        # copy and paste custom columns' values
-
-        with open(input_csv, 'r') as f:
-            reader = csv.reader(f)
-            hdr = next(reader)
-            for i in range(n_custom_columns):
-                results[hdr[i]] = []
-
-            for row in reader:
-                for i in range(n_custom_columns):
-                    results[hdr[i]].append(row[i])
-
-    for output in outputs:
-        results[output] = []
-
-    for i, resp in enumerate(responses):
-
-        for output in outputs:
-            results[output].append(get_nested_output(output, resp))
-
-    df = pd.DataFrame.from_dict(results)
-    df.index = df.iloc[:, 0]
-    df.drop(df.columns[0], axis=1, inplace=True)
-    df.to_csv(output_csv)
-
+    with ExitStack() as stack:
+        custom_columns, custom_rows = [], iter(lambda: [], None)  # no custom columns: an empty list for every row
+        if input_csv is not None and n_custom_columns:
+            # copy and paste custom columns' values, one row at a time
+            reader = csv.reader(stack.enter_context(open(input_csv, 'r', encoding='utf-8-sig')))
+            custom_columns = next(reader)[:n_custom_columns]
+            custom_rows = (row[:n_custom_columns] for row in reader)
+
+        summary = SummaryWriter(output_csv, outputs, custom_columns=custom_columns, resume=resume)
+        stack.callback(summary.close)
+        extractor = summary.extractor  # compiled once for every response
+        order = []  # row keys, in the order of the responses
+
+        def next_custom_values():
+            custom_values = next(custom_rows, None)
+            if custom_values is None:
+                raise ValueError("{} has fewer rows than there are responses ({}).".format(input_csv, len(order) + 1))
+            return custom_values
+
+        if n_workers > 1:
+            jobs = []  # (key, custom values, response) of the rows that are not in the summary yet
+            for i, resp in enumerate(responses, start=1):
+                custom_values = next_custom_values()
+                order.append(summary.row_key(resp, custom_values, default=i))
+                if not summary.has(order[-1]):
+                    jobs.append((order[-1], custom_values, resp))
+            rows = extractor.extract_rows([resp for _, _, resp in jobs], n_workers=n_workers)
+            for (key, custom_values, _), row in zip(jobs, rows):
+                summary.add_row(key, custom_values + row)
+        else:
+            for i, resp in enumerate(responses, start=1):
+                custom_values = next_custom_values()
+                order.append(summary.row_key(resp, custom_values, default=i))
+                start = time.time()
+                if not summary.add(order[-1], resp, custom_values=custom_values) or metrics is None:
+                    continue
+                if isinstance(resp, str):  # path to a saved response
+                    metrics.record_stage('csv_parse', time.time() - start, results_file=resp)
+                else:
+                    run_uuid = resp.get('run_uuid', resp.get('outputs', dict()).get('Scenario', dict()).get('run_uuid'))
+                    metrics.record_stage('csv_parse', time.time() - start, run_uuid=run_uuid)
+    summary.finalize(remove_rows=not resume, order=order)
@@ -1,3 +1,4 @@
+import time
 import openpyxl as xl
 
 
@@ -58,7 +59,7 @@ def time_series_to_worksheet(d, wb, description):
             col_idx += 1
 
 
-def parse_api_responses_to_excel(responses, template="template.xlsx", spreadsheet='results_summary.xlsx'):
+def parse_api_responses_to_excel(responses, template="template.xlsx", spreadsheet='results_summary.xlsx', metrics=None):
     """
     Writes all inputs, outputs, and dispatches to separate worksheets in an Excel workbook.
     REopt object inputs and outputs are on separate sheets (eg. 'PV_inputs' and 'PV_outputs') with each row
@@ -67,12 +68,15 @@ def parse_api_responses_to_excel(responses, template="template.xlsx", spreadshee
     :param responses: list of dictionaries - one dict = one api response
     :param template: str, path/to/template.xlsx which is the template file for the spreadsheet
     :param spreadsheet: str, path/to/excel_spreadsheet.xlsx to write results summary
+    :param metrics: optional src.job_metrics.JobMetrics to record the time to write each response in (stage
+        'excel_export'), and the time to save the workbook (stage 'excel_save')
     :return: None
     """
     wb = xl.load_workbook(template)
     ws_sites = wb.active
 
     for row_idx, resp in enumerate(responses):
+        start = time.time()
         time_series_dict = dict()
         inputs_dict = resp['inputs']['Scenario']
         outputs_dict = resp['outputs']['Scenario']
@@ -104,6 +108,11 @@ def parse_api_responses_to_excel(responses, template="template.xlsx", spreadshee
             time_series_dict[Key] = dict_to_worksheet(outputs_dict['Site'][Key], wb, row_idx, description, Key + '_outputs')
 
         time_series_to_worksheet(time_series_dict, wb, description)
+        if metrics is not None:
+            metrics.record_stage('excel_export', time.time() - start, run_uuid=outputs_dict.get('run_uuid'))
+    start = time.time()
     wb.save(spreadsheet)
+    if metrics is not None:
+        metrics.record_stage('excel_save', time.time() - start)
 
 # TODO address "UserWarning: Title is more than 31 characters. Some applications may not be able to read the file"
\ No newline at end of file
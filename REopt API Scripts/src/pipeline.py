@@ -0,0 +1,248 @@
+"""
+Streaming pipeline from a multi-site input csv to a summary csv.
+
+The batch workflow builds every post, then waits for every response, and only then writes the summary csv. Here each
+site flows through these stages on its own, as soon as the previous stage is done with it:
+    parse    build the site's post from its row of the input csv (one thread)
+    submit   POST the job, or take the response from the cache / job ledger (n_submitters threads)
+    poll     poll the results URL until the run finishes (concurrency threads)
+    save     save the response to results_dir, and record it in the ledger and cache (one thread)
+    summary  pull the template's outputs out of the response and append them as a row of the summary (one thread)
+The stages are connected by bounded queues, so a slow stage holds back the ones before it instead of letting work pile
+up in memory, and each response is dropped once its summary row is written. Rows are appended to a rows file (eg.
+outputs/results_summary_rows.csv, see src.summary_writer) in the order that runs finish, and output_csv is written
+from it in input order at the end. Rows are keyed by the site_number custom column if there is one, or else by
+run_uuid. Sites that are already in the rows file, from an earlier run that stopped, are not run again: with a
+site_number column they are skipped before they are submitted, and without one when the ledger or cache has the run
+of their post.
+
+If the parse stage fails or the pipeline is interrupted (Ctrl-C), the stages stop taking new jobs and drop the ones
+that are queued, and output_csv is written from the rows that are already done. Runs that were submitted but not saved
+are in the ledger (if there is one) for the next run.
+
+Example, from the "REopt API Scripts" directory:
+    run_pipeline('inputs/scenarios.csv', api_url, API_KEY, csv_template='inputs/results_template.csv',
+                 output_csv='outputs/results_summary.csv', n_custom_columns=2, concurrency=20)
+"""
+import csv
+import os
+import queue
+import threading
+import time
+from src.logger import log
+from src.multi_site_inputs_parser import iter_multi_site_posts
+from src.post_and_poll import finish_job, get_results_url, prepare_job, submit_job
+from src.results_poller import is_v3, poll_results
+from src.results_storage import save_results
+from src.summary_writer import SummaryWriter
+
+_DONE = object()  # end of stream marker passed between stages
+
+
+def start_stage(name, func, in_queue, out_queue, n_workers, on_error, stop):
+    """
+    Start worker threads that take jobs from in_queue, call func on them, and put the returned jobs on out_queue.
+    When in_queue is exhausted the last worker to finish passes the end marker on to out_queue. Once stop is set, the
+    workers drop the jobs they take instead of calling func on them, so the queues drain and the workers finish.
+    :param name: stage name, for logging
+    :param func: function of a job dict returning the job (or None to drop it)
+    :param in_queue: queue.Queue of jobs
+    :param out_queue: queue.Queue for the next stage, or None for the last stage
+    :param n_workers: number of threads
+    :param on_error: function of (stage name, job, exception) called when func raises
+    :param stop: threading.Event that stops the stage
+    :return: list of threads
+    """
+    remaining = [n_workers]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            job = in_queue.get()
+            if job is _DONE:
+                in_queue.put(_DONE)  # for the other workers of this stage
+                break
+            if stop.is_set():
+                continue
+            try:
+                job = func(job)
+            except Exception as e:
+                on_error(name, job, e)
+                continue
+            if job is not None and out_queue is not None and not stop.is_set():
+                out_queue.put(job)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and out_queue is not None:
+            out_queue.put(_DONE)
+
+    threads = [threading.Thread(target=work, name='{}-{}'.format(name, i), daemon=True) for i in range(n_workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def join_threads(threads):
+    for t in threads:
+        while t.is_alive():
+            t.join(1)  # short joins so that KeyboardInterrupt is not held up
+
+
+def run_pipeline(path_to_csv, api_url, API_KEY, csv_template, output_csv, results_dir='.', n_custom_columns=0,
+                 n_sites=None, start_row=0, end_row=None, concurrency=10, n_submitters=2, queue_size=None,
+                 poll_interval=5, ledger=None, cache=None, use_cache=True, compression=None, metrics=None,
+                 validator=None):
+    """
+    Run every site of a multi-site input csv through the API and write a summary row for each as soon as it finishes
+    :param path_to_csv: path to csv file containing rows for each site and column headers (see multi_site_csv_parser)
+    :param api_url:
+    :param API_KEY:
+    :param csv_template: path to csv file with headers for output fields (see parse_responses_to_csv_with_template)
+    :param output_csv: path to the summary csv, written at the end from its rows file, which is appended to row by row
+    :param results_dir: directory to save each response to, as results_<row number>.json (row 1 is the first site)
+    :param n_custom_columns: number of custom columns to copy from the input csv to output_csv. If 0 then a "row"
+        column with the row number of the site in the input csv is written instead.
+    :param n_sites: default=None. If integer value is passed then only that many sites will be processed.
+    :param start_row: index of the first site (row after the header) to process, starting at 0
+    :param end_row: default=None. If integer value is passed then sites up to (not including) end_row are processed.
+    :param concurrency: number of runs polled at the same time
+    :param n_submitters: number of POSTs made at the same time
+    :param queue_size: maximum number of jobs waiting between two stages. Default is concurrency.
+    :param poll_interval: seconds between polls of each results end-point
+    :param ledger: optional src.job_ledger.JobLedger (see get_api_results)
+    :param cache: optional src.response_cache.ResponseCache (see get_api_results)
+    :param use_cache: set to False to bypass cache lookups
+    :param compression: None, 'gzip' or 'xz' (see get_api_results)
+    :param metrics: optional src.job_metrics.JobMetrics to record every job's timing in
+    :param validator: optional src.input_validator.InputValidator; invalid posts are logged as failed rows instead of
+        being submitted
+    :return: dict with the number of rows read, finished, failed and skipped (already in the summary)
+    """
+    queue_size = queue_size or concurrency
+    posts_queue, runs_queue, results_queue, saved_queue = [queue.Queue(maxsize=queue_size) for _ in range(4)]
+    counts = {'n_rows': 0, 'n_finished': 0, 'n_failed': 0, 'n_skipped': 0}
+    counts_lock = threading.Lock()
+    stop = threading.Event()
+    keys = dict()  # row number: key of the row in the summary, for the order of output_csv
+    v3 = is_v3(api_url)
+
+    with open(csv_template, 'r') as f:
+        outputs = next(csv.reader(f))  # names of parameters to pull out of responses and put in output_csv
+    with open(path_to_csv, 'r', encoding='utf-8-sig') as f:  # same column names as pd.read_csv, without a BOM
+        custom_columns = next(csv.reader(f))[:n_custom_columns] or ['row']
+
+    def finish(job, status=None):
+        if status is not None:
+            job['timing']['status'] = status
+        if metrics is not None:
+            metrics.finish(job['timing'])
+
+    def skip(job, key):
+        keys[job['row']] = key
+        with counts_lock:
+            counts['n_skipped'] += 1
+
+    def on_error(stage, job, e):
+        log.error("Row {} failed in {} stage: {}".format(job['row'], stage, e))
+        with counts_lock:
+            counts['n_failed'] += 1
+        finish(job, status='error')
+
+    def submit(job):
+        post = job['post']
+        job['timing'] = metrics.start_job(results_file=job['results_file']) if metrics is not None else dict()
+        if validator is not None:
+            validator.validate_post(post)
+        job['input_hash'], job['run_uuid'], job['results'] = prepare_job(post, api_url, job['timing'], ledger=ledger,
+                                                                         cache=cache, use_cache=use_cache)
+        if job['key'] is None:  # no site_number: an earlier run of the post is found by its run_uuid
+            key = summary.row_key(job['results']) if job['results'] is not None else job['run_uuid']
+            if key is not None and summary.has(key):
+                skip(job, key)
+                return None
+        if job['results'] is None:
+            job['run_uuid'] = submit_job(post, API_KEY, api_url, job['timing'], run_id=job['run_uuid'],
+                                         input_hash=job['input_hash'], ledger=ledger,
+                                         results_file=job['results_file'])
+            if job['run_uuid'] is None:
+                raise RuntimeError("no run_uuid from POST.")
+        return job
+
+    def poll(job):
+        if job['results'] is None:
+            poll_start = time.time()
+            job['results'] = poll_results(get_results_url(api_url, API_KEY, job['run_uuid']),
+                                          poll_interval=poll_interval, v3=v3, timing=job['timing'], stop_event=stop)
+            job['timing']['queue_solve_seconds'] = job['timing'].pop('done_time', time.time()) - poll_start
+        return job
+
+    def save(job):
+        if job['timing']['source'] == 'api':
+            job['results_file'] = finish_job(job['post'], api_url, job['results'], job['results_file'],
+                                             job['timing'], input_hash=job['input_hash'], ledger=ledger, cache=cache,
+                                             compression=compression)
+        elif job['timing']['source'] == 'cache':  # the ledger's results are already saved
+            job['results_file'] = save_results(job['results'], job['results_file'], compression=compression)
+        del job['post']  # no longer needed, so free any load profiles
+        return job
+
+    def summarize(job):
+        start = time.time()
+        key = job['key'] or summary.row_key(job['results'], default=job['run_uuid'] or 'row {}'.format(job['row']))
+        keys[job['row']] = key
+        if not summary.add(key, job['results'], custom_values=job['custom_values']):
+            skip(job, key)
+            return None
+        if metrics is not None:
+            metrics.record_stage('csv_parse', time.time() - start, run_uuid=job.get('run_uuid'))
+        with counts_lock:
+            counts['n_finished'] += 1
+        finish(job)
+        return None
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    summary = SummaryWriter(output_csv, outputs, custom_columns=custom_columns)
+
+    log.info("Running pipeline for {} with concurrency of {}...".format(path_to_csv, concurrency))
+    threads = []
+    threads += start_stage('submit', submit, posts_queue, runs_queue, n_submitters, on_error, stop)
+    threads += start_stage('poll', poll, runs_queue, results_queue, concurrency, on_error, stop)
+    threads += start_stage('save', save, results_queue, saved_queue, 1, on_error, stop)
+    threads += start_stage('summary', summarize, saved_queue, None, 1, on_error, stop)
+
+    try:
+        try:  # parse stage, on this thread
+            for i, (site_inputs, post) in enumerate(iter_multi_site_posts(path_to_csv, api_url, API_KEY,
+                                                                          n_sites=n_sites, start_row=start_row,
+                                                                          end_row=end_row), start=start_row):
+                counts['n_rows'] += 1
+                job = {'row': i + 1, 'post': post,
+                       'results_file': os.path.join(results_dir, 'results_{}.json'.format(i + 1)),
+                       'custom_values': [site_inputs.get(c) for c in custom_columns] if n_custom_columns else [i + 1]}
+                job['key'] = summary.row_key(None, job['custom_values'])  # site_number, if there is one
+                if job['key'] is not None and summary.has(job['key']):
+                    skip(job, job['key'])
+                    continue
+                posts_queue.put(job)
+        except BaseException:
+            stop.set()  # before the end marker, which waits for room in posts_queue
+            raise
+        finally:
+            posts_queue.put(_DONE)
+        join_threads(threads)
+    except BaseException as e:
+        log.error("Stopping pipeline ({!r}); writing the summary of the rows that are done...".format(e))
+        stop.set()
+        raise
+    finally:
+        join_threads(threads)  # the workers drop the jobs that are left once stop is set
+        summary.close()
+        summary.finalize(order=[keys[row] for row in sorted(keys)])
+
+    log.info("Pipeline finished {} of {} rows ({} failed, {} already done). Summary written to {}".format(
+        counts['n_finished'], counts['n_rows'], counts['n_failed'], counts['n_skipped'], output_csv))
+    if metrics is not None:
+        metrics.log_summary()
+    return counts
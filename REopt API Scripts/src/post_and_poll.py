@@ -1,39 +1,165 @@
-import requests
+import asyncio
+import functools
+import threading
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 from src.logger import log
-from src.results_poller import poller, poller_v3
+from src.http_session import get_session
+from src.job_ledger import hash_post
+from src.results_storage import save_results, load_results
+from src.results_poller import get_results_status, is_v3, poll_results, poller_async
 
 
-def get_api_results(post, API_KEY, api_url, results_file='results.json', run_id=None):
+def get_api_results(post, API_KEY, api_url, results_file='results.json', run_id=None, ledger=None, cache=None,
+                    use_cache=True, compression=None, metrics=None):
     """
     Function for posting job and polling results end-point
     :param post:
     :param results_file:
     :param API_KEY:
     :param api_url:
+    :param run_id: optional run_uuid of a job that was already posted (skips the POST)
+    :param ledger: optional src.job_ledger.JobLedger. If the post is already in the ledger then its saved results are
+        returned (if the run finished) or its run_uuid is polled (if the run was still in flight) instead of POSTing.
+    :param cache: optional src.response_cache.ResponseCache. Identical posts to the same API version are returned from
+        the cache (and saved to results_file) instead of being run again; new responses are added to the cache.
+    :param use_cache: set to False to bypass cache lookups (new responses are still added to the cache)
+    :param compression: None to save results_file as plain JSON, or 'gzip' or 'xz' to save it compressed (the
+        extension is added to results_file if missing). Use src.results_storage.load_results to read it back.
+    :param metrics: optional src.job_metrics.JobMetrics to record the job's timing in
     :return: results dictionary / API response
     """
+    timing = metrics.start_job(results_file=results_file) if metrics is not None else dict()
+    try:
+        input_hash, run_id, results = prepare_job(post, api_url, timing, run_id=run_id, ledger=ledger, cache=cache,
+                                                  use_cache=use_cache)
+        if results is not None:
+            if timing['source'] == 'cache':
+                save_results(results, results_file, compression=compression)
+            return results
 
+        run_id = submit_job(post, API_KEY, api_url, timing, run_id=run_id, input_hash=input_hash, ledger=ledger,
+                            results_file=results_file)
+        if run_id is None:
+            timing['status'] = 'no run_uuid'
+            log.error("Unable to get results: no run_uuid from POST.")
+            return None
+
+        poll_start = time.time()
+        results = poll_results(get_results_url(api_url, API_KEY, run_id), v3=is_v3(api_url), timing=timing)
+        timing['queue_solve_seconds'] = timing.pop('done_time', time.time()) - poll_start
+        finish_job(post, api_url, results, results_file, timing, input_hash=input_hash, ledger=ledger, cache=cache,
+                   compression=compression)
+        return results
+    finally:
+        if metrics is not None:
+            metrics.finish(timing)
+
+
+def get_results_url(api_url, API_KEY, run_id):
+    return api_url + '/job/' + run_id + '/results/?api_key=' + API_KEY
+
+
+def prepare_job(post, api_url, timing, run_id=None, ledger=None, cache=None, use_cache=True):
+    """
+    Look a post up in the cache and the job ledger before it is submitted. Shared by get_api_results,
+    get_api_results_async and src.pipeline.
+    :param post:
+    :param api_url:
+    :param timing: job's timing dict; source, run_uuid and status are set if the results are found
+    :param run_id: optional run_uuid of a job that was already posted (skips the lookups)
+    :param ledger: optional src.job_ledger.JobLedger
+    :param cache: optional src.response_cache.ResponseCache
+    :param use_cache: set to False to bypass the cache lookup
+    :return: (input_hash, run_id, results) where input_hash is the post's ledger key (None without a ledger), run_id
+        is the run_uuid to poll (or None to submit the post) and results is the cached or saved response (or None)
+    """
+    if run_id is not None:
+        return None, run_id, None
+    if cache is not None and use_cache:
+        results = cache.get(post, api_url)
+        if results is not None:
+            timing.update(source='cache', status=get_results_status(results))
+            return None, None, results
+    if ledger is None:
+        return None, None, None
+    input_hash, run_id, results = resume_from_ledger(post, api_url, ledger)
+    if results is not None:
+        timing.update(source='ledger', run_uuid=run_id, status=get_results_status(results))
+    return input_hash, run_id, results
+
+
+def submit_job(post, API_KEY, api_url, timing, run_id=None, input_hash=None, ledger=None, results_file=None):
+    """
+    POST a job (unless it already has a run_uuid) and record the submission in the ledger
+    :param post:
+    :param API_KEY:
+    :param api_url:
+    :param timing: job's timing dict; submit_seconds, source and run_uuid are set
+    :param run_id: run_uuid of a job that was already posted, or None to POST it
+    :param input_hash: the post's ledger key from prepare_job, or None without a ledger
+    :param ledger: optional src.job_ledger.JobLedger
+    :param results_file: path that the response will be saved to, for the ledger
+    :return: run_uuid, or None if the POST did not return one
+    """
     if run_id is None:
+        submit_time = time.time()
         run_id = get_run_uuid(post, API_KEY=API_KEY, api_url=api_url)
-
+        timing['submit_seconds'] = time.time() - submit_time
+        if input_hash is not None and run_id is not None:
+            ledger.record_submit(input_hash, api_url, run_id, results_file=results_file)
     if run_id is not None:
+        timing.update(source='api', run_uuid=run_id)
+    return run_id
 
-        results_url = api_url + '/job/<run_uuid>/results/?api_key=' + API_KEY
-        if "stable" in results_url or "v3" in results_url:
-            results = poller_v3(url=results_url.replace('<run_uuid>', run_id))
-        else: # for v1 and v2
-            results = poller(url=results_url.replace('<run_uuid>', run_id))
 
-        with open(results_file, 'w') as fp:
-            json.dump(obj=results, fp=fp)
+def finish_job(post, api_url, results, results_file, timing, input_hash=None, ledger=None, cache=None,
+               compression=None):
+    """
+    Save the response of a run that was polled, record its status in the ledger and add it to the cache
+    :param post:
+    :param api_url:
+    :param results: dictionary response
+    :param results_file: path to save the response to
+    :param timing: job's timing dict; status, save_seconds and results_file are set
+    :param input_hash: the post's ledger key from prepare_job, or None without a ledger
+    :param ledger: optional src.job_ledger.JobLedger
+    :param cache: optional src.response_cache.ResponseCache
+    :param compression: None, 'gzip' or 'xz' (see get_api_results)
+    :return: path that the response was saved to
+    """
+    timing['status'] = get_results_status(results)
+    save_time = time.time()
+    results_file = save_results(results, results_file, compression=compression)
+    timing.update(save_seconds=time.time() - save_time, results_file=results_file)
+    if input_hash is not None and timing['status'] is not None:  # no status: poll it again on the next run
+        ledger.record_status(input_hash, timing['status'], results_file=results_file)
+    if cache is not None:
+        cache.put(post, api_url, results)
+    return results_file
 
-        log.info("Saved results to {}".format(results_file))
-    else:
-        results = None
-        log.error("Unable to get results: no run_uuid from POST.")
 
-    return results
+def resume_from_ledger(post, api_url, ledger):
+    """
+    Look up a post in the job ledger
+    :param post:
+    :param api_url:
+    :param ledger: src.job_ledger.JobLedger
+    :return: (input_hash, run_id, results) where run_id is the run_uuid of an earlier submission of the post (or None)
+        and results is the saved response if that run already finished (or None)
+    """
+    input_hash = hash_post(post, api_url)
+    job = ledger.get(input_hash)
+    if job is None:
+        return input_hash, None, None
+    if ledger.is_complete(job):
+        log.info("Skipping run {}: already finished with status {}. Loading results from {}"
+                 .format(job["run_uuid"], job["status"], job["results_file"]))
+        return input_hash, job["run_uuid"], load_results(job["results_file"])
+    log.info("Resuming polling of run {} submitted at {}.".format(
+        job["run_uuid"], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job["submit_time"]))))
+    return input_hash, job["run_uuid"], None
 
 
 def get_run_uuid(post, API_KEY, api_url):
@@ -45,7 +171,7 @@ def get_run_uuid(post, API_KEY, api_url):
     :return: job run_uuid
     """
     post_url = api_url + '/job/?api_key=' + API_KEY
-    resp = requests.post(post_url, json=post)
+    resp = get_session().post(post_url, json=post)
     run_id = None
     if not resp.ok:
         log.error("Status code {}. {}".format(resp.status_code, resp.content))
@@ -63,6 +189,163 @@ def get_run_uuid(post, API_KEY, api_url):
     return run_id
 
 
+async def get_api_results_async(post, API_KEY, api_url, results_file='results.json', run_id=None, poll_interval=5,
+                                executor=None, ledger=None, cache=None, use_cache=True, compression=None,
+                                metrics=None):
+    """
+    Coroutine version of get_api_results: post job, poll results end-point, and save the response to results_file.
+    Blocking requests are run in `executor` so that many scenarios can be in flight on one event loop.
+    :param post:
+    :param API_KEY:
+    :param api_url:
+    :param results_file:
+    :param run_id:
+    :param poll_interval: seconds between polls of the results end-point
+    :param executor: concurrent.futures.Executor for blocking calls; None uses the event loop's default executor
+    :param ledger: optional src.job_ledger.JobLedger (see get_api_results)
+    :param cache: optional src.response_cache.ResponseCache (see get_api_results)
+    :param use_cache: set to False to bypass cache lookups
+    :param compression: None, 'gzip' or 'xz' (see get_api_results)
+    :param metrics: optional src.job_metrics.JobMetrics to record the job's timing in
+    :return: results dictionary / API response
+    """
+    loop = asyncio.get_event_loop()
+    timing = metrics.start_job(results_file=results_file) if metrics is not None else dict()
+    try:
+        input_hash, run_id, results = await loop.run_in_executor(executor, functools.partial(
+            prepare_job, post, api_url, timing, run_id=run_id, ledger=ledger, cache=cache, use_cache=use_cache))
+        if results is not None:
+            if timing['source'] == 'cache':
+                await loop.run_in_executor(executor, functools.partial(
+                    save_results, results, results_file, compression=compression))
+            return results
+
+        run_id = await loop.run_in_executor(executor, functools.partial(
+            submit_job, post, API_KEY, api_url, timing, run_id=run_id, input_hash=input_hash, ledger=ledger,
+            results_file=results_file))
+        if run_id is None:
+            timing['status'] = 'no run_uuid'
+            log.error("Unable to get results: no run_uuid from POST.")
+            return None
+
+        poll_start = time.time()
+        results = await poller_async(url=get_results_url(api_url, API_KEY, run_id), poll_interval=poll_interval,
+                                     executor=executor, v3=is_v3(api_url), timing=timing)
+        timing['queue_solve_seconds'] = timing.pop('done_time', time.time()) - poll_start
+        await loop.run_in_executor(executor, functools.partial(
+            finish_job, post, api_url, results, results_file, timing, input_hash=input_hash, ledger=ledger,
+            cache=cache, compression=compression))
+        return results
+    finally:
+        if metrics is not None:
+            metrics.finish(timing)
+
+
+async def get_api_results_batch_async(posts, API_KEY, api_url, results_files=None, concurrency=10, poll_interval=5,
+                                      run_ids=None, ledger=None, cache=None, use_cache=True, compression=None,
+                                      metrics=None, validator=None):
+    """
+    Submit and poll many posts at the same time, with at most `concurrency` scenarios in flight.
+    Each results_file is saved as soon as its run finishes.
+    :param posts: list of dictionaries to post to the API
+    :param API_KEY:
+    :param api_url:
+    :param results_files: list of paths (same length as posts) to save each response to.
+        Default is results_1.json, results_2.json, ... in the current working directory.
+    :param concurrency: maximum number of scenarios being submitted/polled at once. Connections are reused from the
+        shared pool in src.http_session; use configure_session(pool_maxsize=...) to keep at least this many alive.
+    :param poll_interval: seconds between polls of each results end-point
+    :param run_ids: optional list of run_uuids (same length as posts, None for posts that still need to be POSTed)
+    :param ledger: optional src.job_ledger.JobLedger. Rerunning an interrupted batch with the same ledger skips
+        finished scenarios and resumes polling in-flight ones instead of POSTing them again.
+    :param cache: optional src.response_cache.ResponseCache (see get_api_results)
+    :param use_cache: set to False to bypass cache lookups
+    :param compression: None, 'gzip' or 'xz' (see get_api_results)
+    :param metrics: optional src.job_metrics.JobMetrics to record every job's timing in; its summary is logged at the
+        end of the batch
+    :param validator: optional src.input_validator.InputValidator. All posts are checked before any are submitted;
+        the errors of every invalid post are logged and those posts are not submitted.
+    :return: list of results dictionaries / API responses, in the same order as posts (None for failed scenarios)
+    """
+    posts = list(posts)
+    if results_files is None:
+        results_files = ['results_{}.json'.format(i + 1) for i in range(len(posts))]
+    if run_ids is None:
+        run_ids = [None] * len(posts)
+    if not len(posts) == len(results_files) == len(run_ids):
+        raise ValueError("posts, results_files, and run_ids must have the same length.")
+
+    invalid = set()
+    if validator is not None:
+        valid_rows, errors = validator.split(posts)
+        validator.log_errors(errors)
+        invalid = set(range(len(posts))) - set(valid_rows)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def run_one(i):
+        if i in invalid:
+            return None
+        async with semaphore:
+            try:
+                return await get_api_results_async(posts[i], API_KEY=API_KEY, api_url=api_url,
+                                                   results_file=results_files[i], run_id=run_ids[i],
+                                                   poll_interval=poll_interval, executor=executor,
+                                                   ledger=ledger, cache=cache, use_cache=use_cache,
+                                                   compression=compression, metrics=metrics)
+            except Exception as e:
+                log.error("Scenario {} failed: {}".format(i + 1, e))
+                return None
+
+    log.info("Running {} scenarios with concurrency of {}...".format(len(posts), concurrency))
+    try:
+        results = await asyncio.gather(*[run_one(i) for i in range(len(posts))])
+    finally:
+        executor.shutdown(wait=False)
+    log.info("Finished {} of {} scenarios.".format(sum(r is not None for r in results), len(posts)))
+    if metrics is not None:
+        metrics.log_summary()
+
+    return list(results)
+
+
+def get_api_results_batch(posts, API_KEY, api_url, results_files=None, concurrency=10, poll_interval=5,
+                          run_ids=None, ledger=None, cache=None, use_cache=True, compression=None, metrics=None,
+                          validator=None):
+    """
+    Blocking wrapper around get_api_results_batch_async for scripts and notebooks.
+    In a notebook (where an event loop is already running) the batch is run on its own thread.
+    See get_api_results_batch_async for parameters.
+    :return: list of results dictionaries / API responses, in the same order as posts
+    """
+    def batch():
+        return get_api_results_batch_async(posts, API_KEY=API_KEY, api_url=api_url, results_files=results_files,
+                                           concurrency=concurrency, poll_interval=poll_interval, run_ids=run_ids,
+                                           ledger=ledger, cache=cache, use_cache=use_cache,
+                                           compression=compression, metrics=metrics, validator=validator)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:  # no running event loop
+        return asyncio.run(batch())
+
+    out = {}
+
+    def run_in_thread():
+        try:
+            out['results'] = asyncio.run(batch())
+        except BaseException as e:
+            out['error'] = e
+
+    t = threading.Thread(target=run_in_thread)
+    t.start()
+    t.join()
+    if 'error' in out:
+        raise out['error']
+    return out['results']
+
+
 if __name__ == '__main__':
     """
     In case just need to re-save json response
@@ -0,0 +1,183 @@
+"""
+Client-side rate limiting for calls to the REopt API, shared by the POST and polling paths through src.http_session.
+
+Two token buckets are used:
+ - a short-term bucket that caps requests per second (with some burst), and
+ - a quota bucket that is synced to the API key's X-RateLimit-Limit and X-RateLimit-Remaining headers, so that a long
+   batch slows down to the key's sustainable rate instead of running out of quota and failing partway through.
+Responses with status 429 or 503 pause all requests for the Retry-After time given by the API.
+"""
+import email.utils
+import threading
+import time
+from src.logger import log
+
+# developer.nrel.gov (api.data.gov) quotas are per rolling hour
+QUOTA_PERIOD_SECONDS = 3600
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to `capacity` tokens, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (i.e. burst size)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.last_refill:  # last_refill is in the future while the bucket is paused
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+    def acquire(self, tokens=1):
+        """
+        Block until `tokens` are available, then take them
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    wait = (tokens - self.tokens) / self.rate if self.rate > 0 else 1.0
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for `seconds` (eg. after a Retry-After header). The bucket is emptied and only starts
+        refilling when the pause ends, so that waiting requests resume at `rate` instead of all at once.
+        :return: None
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.last_refill = max(self.last_refill, self.paused_until)
+
+    def update(self, rate=None, capacity=None, tokens=None):
+        """
+        Change the bucket's rate, capacity and/or number of available tokens
+        :return: None
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None:
+                self.rate = float(rate)
+            if capacity is not None:
+                self.capacity = float(capacity)
+            if tokens is not None:
+                self.tokens = float(tokens)
+            self.tokens = min(self.tokens, self.capacity)
+
+
+class RateLimiter:
+    """
+    Combines a requests-per-second bucket with a quota bucket learned from the API's rate limit headers.
+    """
+
+    def __init__(self, requests_per_second=5, burst=10, quota_period=QUOTA_PERIOD_SECONDS, max_retries=5,
+                 default_retry_after=10):
+        """
+        :param requests_per_second: upper limit on sustained requests per second
+        :param burst: number of requests that can be sent at once before requests_per_second applies
+        :param quota_period: seconds over which the API key's X-RateLimit-Limit applies
+        :param max_retries: number of times a request that got a 429 or 503 response is retried
+        :param default_retry_after: seconds to wait after a 429 or 503 response without a Retry-After header (doubled
+            for every retry of the same request)
+        """
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.quota = None  # created from the first response with rate limit headers
+        self.quota_period = quota_period
+        self.max_retries = max_retries
+        self.default_retry_after = default_retry_after
+
+    def acquire(self):
+        """
+        Block until a request can be sent
+        :return: None
+        """
+        waited = self.bucket.acquire()
+        if self.quota is not None:
+            waited += self.quota.acquire()
+        if waited > 1:
+            log.debug("Rate limiter delayed request by {:.1f}s.".format(waited))
+
+    def update_from_response(self, resp):
+        """
+        Sync the quota bucket to X-RateLimit-Limit / X-RateLimit-Remaining headers, if the response has them
+        :param resp: requests.Response
+        :return: None
+        """
+        limit = _header_number(resp.headers.get('X-RateLimit-Limit'))
+        remaining = _header_number(resp.headers.get('X-RateLimit-Remaining'))
+        if limit is None or limit <= 0:
+            return
+        rate = limit / float(self.quota_period)
+        if self.quota is None:
+            self.quota = TokenBucket(rate, limit)
+            log.info("API key quota is {:.0f} requests per {}s.".format(limit, self.quota_period))
+        if remaining is not None:
+            self.quota.update(rate=rate, capacity=limit, tokens=remaining)
+            if remaining < 0.05 * limit:
+                log.warning("Only {:.0f} of {:.0f} API requests remaining; throttling to {:.2f} requests/s."
+                            .format(remaining, limit, rate))
+        else:
+            self.quota.update(rate=rate, capacity=limit)
+
+    def retry_after(self, resp, attempt):
+        """
+        Pause all requests after a 429 (Too Many Requests) or 503 (Service Unavailable) response
+        :param resp: requests.Response
+        :param attempt: number of times this request has been retried so far
+        :return: True if the request should be retried
+        """
+        if resp.status_code not in (429, 503) or attempt >= self.max_retries:
+            return False
+        wait = parse_retry_after(resp.headers.get('Retry-After'))
+        if wait is None:
+            wait = self.default_retry_after * 2 ** attempt
+        log.warning("Status code {} from {}. Retrying in {:.0f}s (retry {} of {})."
+                    .format(resp.status_code, resp.url.split('?')[0], wait, attempt + 1, self.max_retries))
+        self.bucket.pause(wait)
+        return True
+
+
+def parse_retry_after(value):
+    """
+    :param value: Retry-After header, either a number of seconds or an HTTP date
+    :return: seconds to wait, or None if the header is missing or invalid
+    """
+    if value is None:
+        return None
+    seconds = _header_number(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+def _header_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,132 @@
+"""
+On-disk cache of API responses, keyed on the canonical hash of the post and the API version (see
+src.job_ledger.hash_post), so that identical scenarios return from disk instead of running another optimization.
+
+Entries are evicted least-recently-used first once the cache grows beyond max_size_mb.
+"""
+import json
+import os
+import threading
+from src.logger import log
+from src.job_ledger import hash_post
+from src.results_poller import get_results_status
+from src.results_storage import COMPRESSIONS, EXTENSIONS, load_results
+
+
+class ResponseCache:
+    """
+    Content-addressed response cache in a directory, one JSON file per response. Safe to share between threads.
+    """
+
+    def __init__(self, cache_dir='.reopt_cache/responses', max_size_mb=1024, compression='gzip'):
+        """
+        :param cache_dir: directory for cached responses, created if it does not exist
+        :param max_size_mb: total size of cached responses above which the least recently used ones are deleted
+        :param compression: None, 'gzip' or 'xz' (see src.results_storage)
+        """
+        self.cache_dir = cache_dir
+        self.compression = compression
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._size_bytes = None  # computed on first put
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, post, api_url):
+        """
+        :return: path to the cache file for a post
+        """
+        key = hash_post(post, api_url)
+        return os.path.join(self.cache_dir, key[:2], key + '.json' + EXTENSIONS[self.compression])
+
+    def get(self, post, api_url):
+        """
+        :param post: dictionary posted to the API
+        :param api_url:
+        :return: cached response, or None on a cache miss
+        """
+        fp = self.path(post, api_url)
+        try:
+            response = load_results(fp)
+        except (OSError, ValueError, EOFError):
+            return None
+        try:
+            os.utime(fp)  # mark as recently used
+        except OSError:
+            pass
+        log.info("Loaded cached response from {}".format(fp))
+        return response
+
+    def put(self, post, api_url, response):
+        """
+        Save a response to the cache (unless it is an error response) and evict old entries if the cache is full
+        :param post: dictionary posted to the API
+        :param api_url:
+        :param response: API response
+        :return: None
+        """
+        if not is_cacheable(response):
+            return
+        fp = self.path(post, api_url)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        tmp = fp + '.tmp{}'.format(threading.get_ident())
+        with COMPRESSIONS[self.compression](tmp, 'wt') as f:
+            f.write(json.dumps(response, separators=(',', ':')))
+        old_size = os.path.getsize(fp) if os.path.isfile(fp) else 0
+        os.replace(tmp, fp)  # atomic, so that readers never see a partly written file
+
+        with self._lock:
+            if self._size_bytes is None:
+                self._size_bytes = self._scan()[1]
+            else:
+                self._size_bytes += os.path.getsize(fp) - old_size
+            if self._size_bytes > self.max_size_bytes:
+                self._evict()
+
+    def _scan(self):
+        """
+        :return: (list of (last used time, size, path) of cached files, total size in bytes)
+        """
+        entries = []
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if '.json' in entry.name and '.tmp' not in entry.name:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(e[1] for e in entries)
+
+    def _evict(self):
+        entries, total = self._scan()
+        n_evicted = 0
+        for _, size, fp in sorted(entries):
+            if total <= self.max_size_bytes:
+                break
+            try:
+                os.remove(fp)
+            except OSError:
+                continue
+            total -= size
+            n_evicted += 1
+        self._size_bytes = total
+        log.info("Evicted {} responses from cache {}.".format(n_evicted, self.cache_dir))
+
+    def clear(self):
+        """
+        Delete all cached responses
+        :return: None
+        """
+        with self._lock:
+            for _, _, fp in self._scan()[0]:
+                os.remove(fp)
+            self._size_bytes = 0
+
+
+def is_cacheable(response):
+    """
+    Only responses with a final, non-error status are cached.
+    :param response: API response
+    :return: bool
+    """
+    status = get_results_status(response)
+    return status is not None and status != "Optimizing..." and "error" not in status.lower()
@@ -0,0 +1,241 @@
+"""
+Reading a few output fields from saved API responses without decoding the whole response.
+
+Summaries usually need only a handful of scalars (eg. npv and PV size_kw) but json.load decodes everything, including
+every 8760 to 35040 value time-series list in the inputs and outputs. read_fields scans the raw JSON text instead:
+it walks down to the output objects, decodes only the values of the wanted fields, skips over every other value
+(numeric arrays are skipped with a single regex match), and stops as soon as all of the wanted fields are found.
+
+Keys follow the results_template.csv convention:
+    "PV|size_kw"   field size_kw of output object PV
+    "npv"          first output object that has a field npv
+and work for both v3 responses (outputs -> PV) and v2 responses (outputs -> Scenario -> Site -> PV).
+
+scan_array_lengths uses the same scan to list the numeric arrays of the output objects and their lengths, eg. to find
+every time series in a batch of responses without decoding them.
+
+Example:
+    rows = read_fields_from_files(["outputs/results_1.json", "outputs/results_2.json.gz"],
+                                  ["Financial|npv", "PV|size_kw"])
+"""
+import json
+import re
+from json.decoder import scanstring
+from src.results_storage import open_results
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+FLAT_ARRAY = re.compile(r'\[[^\[\]{}"]*\]')  # array without strings or nested containers, eg. a time-series
+SCALAR = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?|true|false|null|NaN|-?Infinity')
+CONTAINER_CHARS = re.compile(r'["\[\]{}]')
+
+_decoder = json.JSONDecoder()
+
+
+class FieldsFound(Exception):
+    """
+    Raised to stop scanning once every wanted field has been found
+    """
+    pass
+
+
+def skip_whitespace(text, pos):
+    return WHITESPACE.match(text, pos).end()
+
+
+def skip_value(text, pos):
+    """
+    :param text: JSON text
+    :param pos: index of the first character of a value
+    :return: index just after the value
+    """
+    char = text[pos]
+    if char == '"':
+        return scanstring(text, pos + 1)[1]
+    if char == '[':
+        match = FLAT_ARRAY.match(text, pos)
+        if match:
+            return match.end()
+    if char in '[{':
+        depth = 0
+        while True:
+            match = CONTAINER_CHARS.search(text, pos)
+            if match is None:
+                raise ValueError("Unterminated container starting at {}".format(pos))
+            char, pos = match.group(), match.end()
+            if char == '"':
+                pos = scanstring(text, pos)[1]
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+    match = SCALAR.match(text, pos)
+    if match is None:
+        raise ValueError("Expecting value at {}".format(pos))
+    return match.end()
+
+
+def scan_object(text, pos, on_member):
+    """
+    Walk the members of a JSON object
+    :param text: JSON text
+    :param pos: index of the object's opening brace
+    :param on_member: function of (key, index of the value) that returns the index just after the value
+    :return: index just after the object's closing brace
+    """
+    if text[pos] != '{':
+        return skip_value(text, pos)
+    pos = skip_whitespace(text, pos + 1)
+    if text[pos] == '}':
+        return pos + 1
+    while True:
+        key, pos = scanstring(text, pos + 1)
+        pos = skip_whitespace(text, pos)  # at ':'
+        pos = on_member(key, skip_whitespace(text, pos + 1))
+        pos = skip_whitespace(text, pos)
+        if text[pos] == '}':
+            return pos + 1
+        if text[pos] != ',':
+            raise ValueError("Expecting ',' or '}}' at {}".format(pos))
+        pos = skip_whitespace(text, pos + 1)
+
+
+def split_keys(keys):
+    """
+    :param keys: list of "Obj|field" or "field" keys
+    :return: (piped, unpiped) where piped is {Obj: {field: key}} and unpiped is {field: key}
+    """
+    piped, unpiped = dict(), dict()
+    for key in keys:
+        if '|' in key:
+            obj, field = key.split('|', 1)
+            piped.setdefault(obj, dict())[field] = key
+        else:
+            unpiped[key] = key
+    return piped, unpiped
+
+
+def scan_fields(text, keys):
+    """
+    Pull output fields out of the JSON text of an API response
+    :param text: JSON text of a v3 or v2 response
+    :param keys: list of "Obj|field" or "field" keys (see module docstring)
+    :return: dict of key: value, with None for fields that are not in the response
+    """
+    piped, unpiped = split_keys(keys)
+    found = dict()
+
+    def output_object(obj):
+        def on_member(field, pos):
+            wanted = [key for key in (piped.get(obj, dict()).get(field), unpiped.get(field))
+                      if key is not None and key not in found]
+            if not wanted:
+                return skip_value(text, pos)
+            value, pos = _decoder.raw_decode(text, pos)
+            for key in wanted:
+                found[key] = value
+            if len(found) == len(keys):
+                raise FieldsFound()
+            return pos
+        return on_member
+
+    def output_objects(key, pos):  # members of v3 "outputs" or v2 "Site"
+        if key[0].isupper() and text[pos] == '{':
+            return scan_object(text, pos, output_object(key))
+        return skip_value(text, pos)
+
+    def v2_scenario(key, pos):
+        if key == 'Site':
+            return scan_object(text, pos, output_objects)
+        return skip_value(text, pos)
+
+    def outputs(key, pos):
+        if key == 'Scenario':
+            return scan_object(text, pos, v2_scenario)
+        return output_objects(key, pos)
+
+    def response(key, pos):
+        if key == 'outputs':
+            return scan_object(text, pos, outputs)
+        return skip_value(text, pos)
+
+    keys = list(dict.fromkeys(keys))
+    if keys:
+        try:
+            scan_object(text, skip_whitespace(text, 0), response)
+        except FieldsFound:
+            pass
+    return {key: found.get(key) for key in keys}
+
+
+def scan_array_lengths(text):
+    """
+    Find the numeric arrays (eg. time-series) of the output objects in the JSON text of an API response
+    :param text: JSON text of a v3 or v2 response
+    :return: (v2, lengths) where v2 is True for a v2 response and lengths is a dict of (output object, field): number
+        of values
+    """
+    lengths = dict()
+    layout = {'v2': False}
+
+    def output_object(obj):
+        def on_member(field, pos):
+            match = FLAT_ARRAY.match(text, pos) if text[pos] == '[' else None
+            if match is None:
+                return skip_value(text, pos)
+            if text[pos + 1:match.end() - 1].strip():
+                lengths[(obj, field)] = text.count(',', pos, match.end()) + 1
+            else:
+                lengths[(obj, field)] = 0
+            return match.end()
+        return on_member
+
+    def output_objects(key, pos):
+        if key[0].isupper() and text[pos] == '{':
+            return scan_object(text, pos, output_object(key))
+        return skip_value(text, pos)
+
+    def v2_scenario(key, pos):
+        if key == 'Site':
+            return scan_object(text, pos, output_objects)
+        return skip_value(text, pos)
+
+    def outputs(key, pos):
+        if key == 'Scenario':
+            layout['v2'] = True
+            return scan_object(text, pos, v2_scenario)
+        return output_objects(key, pos)
+
+    def response(key, pos):
+        if key == 'outputs':
+            return scan_object(text, pos, outputs)
+        return skip_value(text, pos)
+
+    scan_object(text, skip_whitespace(text, 0), response)
+    return layout['v2'], lengths
+
+
+def read_fields(results_file, keys):
+    """
+    Read output fields from a saved response (plain or compressed) without decoding the rest of it
+    :param results_file: path to a json file saved by save_results (or by json.dump)
+    :param keys: list of "Obj|field" or "field" keys, eg. ["Financial|npv", "PV|size_kw"]
+    :return: dict of key: value, with None for fields that are not in the response
+    """
+    with open_results(results_file, 'rt') as f:
+        text = f.read()
+    return scan_fields(text, keys)
+
+
+def read_fields_from_files(results_files, keys):
+    """
+    :param results_files: list of paths to saved responses
+    :param keys: list of "Obj|field" or "field" keys
+    :return: list of lists of values, one list (in the order of keys) per file
+    """
+    rows = []
+    for fp in results_files:
+        fields = read_fields(fp, keys)
+        rows.append([fields[key] for key in keys])
+    return rows
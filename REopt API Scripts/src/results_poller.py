@@ -1,78 +1,296 @@
 """
 function for polling reopt api results url
 """
-import requests
+import asyncio
+import functools
+import heapq
 import json
+import random
 import time
+import requests
 from src.logger import log
+from src.http_session import get_session
+
+
+def get_results_status(results):
+    """
+    :param results: API response from a v3 or v1/v2 results end-point
+    :return: status string (eg. "optimal"), or None if the response has no status
+    """
+    if not isinstance(results, dict):
+        return None
+    if "status" in results:
+        return results["status"]
+    try:
+        return results['outputs']['Scenario']['status']
+    except (KeyError, TypeError):
+        return None
+
+
+def load_response(resp):
+    """
+    Decode a results end-point response. Non-JSON bodies (eg. from a 429 or 503 error page) are logged and returned
+    as an empty dict so that the pollers count them like a response without a status instead of crashing.
+    :param resp: requests.Response
+    :return: dictionary response
+    """
+    try:
+        return json.loads(resp.content)
+    except ValueError:
+        log.warning("Status code {}. Response was not JSON: {}".format(resp.status_code, resp.content[:200]))
+        return dict()
+
+
+def record_poll(timing, resp, request_time):
+    """
+    Update a job's timing dict after a GET of its results URL. The download fields are overwritten on every poll, so
+    that once polling stops they describe the final response.
+    :param timing: dict to update, or None
+    :param resp: requests.Response
+    :param request_time: time.time() when the GET was sent
+    :return: None
+    """
+    if timing is None:
+        return
+    now = time.time()
+    timing['n_polls'] = timing.get('n_polls', 0) + 1
+    timing['download_bytes'] = len(resp.content)
+    timing['download_seconds'] = now - request_time
+    timing['done_time'] = now
 
 
-def poller(url, poll_interval=5):
+KEY_ERROR_THRESHOLD = 3  # responses without a status before a run is given up on
+
+
+def is_v3(api_url):
+    """
+    :param api_url: API or results url
+    :return: True for v3 (/stable) urls, False for v1 and v2 urls
+    """
+    return "stable" in api_url or "v3" in api_url
+
+
+def poll_status(resp_dict, v3, key_error_count, name):
+    """
+    Status of a results end-point response, for deciding whether to poll the run again
+    :param resp_dict: dictionary response
+    :param v3: True for v3 responses, False for v1 and v2 responses
+    :param key_error_count: number of responses without a status so far
+    :param name: url or run_uuid of the run, for logging
+    :return: (status, key_error_count), where status is "Optimizing..." for a response without a status (until more
+        than KEY_ERROR_THRESHOLD of them) and None after that
+    """
+    try:
+        if v3:
+            return resp_dict['status'], key_error_count
+        return resp_dict['outputs']['Scenario']['status'], key_error_count
+    except KeyError:
+        key_error_count += 1
+        log.info('KeyError count for {}: {}'.format(name, key_error_count))
+        if key_error_count > KEY_ERROR_THRESHOLD:
+            log.info('Stopped polling {} due to KeyError count threshold of {} exceeded.'
+                     .format(name, KEY_ERROR_THRESHOLD))
+            return None, key_error_count
+        return "Optimizing...", key_error_count
+
+
+def poll_results(url, poll_interval=5, v3=True, timing=None, stop_event=None):
     """
     Function for polling the REopt API results URL until status is not "Optimizing..."
     :param url: results url to poll
     :param poll_interval: seconds
+    :param v3: True for v3 (/stable) responses, False for v1 and v2 responses
+    :param timing: optional dict, filled in with n_polls, download_bytes, download_seconds and done_time
+        (see src.job_metrics)
+    :param stop_event: optional threading.Event; setting it stops polling and returns the last response
     :return: dictionary response (once status is not "Optimizing...")
     """
-
     key_error_count = 0
-    key_error_threshold = 3
-    status = "Optimizing..."
     log.info("Polling {} for results with interval of {}s...".format(url, poll_interval))
     while True:
 
-        resp = requests.get(url=url, verify=False)
-        resp_dict = json.loads(resp.content)
-
-        try:
-            status = resp_dict['outputs']['Scenario']['status']
-        except KeyError:
-            key_error_count += 1
-            log.info('KeyError count: {}'.format(key_error_count))
-            if key_error_count > key_error_threshold:
-                log.info('Breaking polling loop due to KeyError count threshold of {} exceeded.'
-                         .format(key_error_threshold))
-                break
+        request_time = time.time()
+        resp = get_session().get(url=url, verify=False)
+        resp_dict = load_response(resp)
+        record_poll(timing, resp, request_time)
 
+        status, key_error_count = poll_status(resp_dict, v3, key_error_count, url)
         if status != "Optimizing...":
             break
+        elif stop_event is not None:
+            if stop_event.wait(poll_interval):
+                log.info("Stopped polling {}.".format(url))
+                break
         else:
             time.sleep(poll_interval)
 
     return resp_dict
 
 
-def poller_v3(url, poll_interval=5):
+def poller(url, poll_interval=5, timing=None, stop_event=None):
     """
-    Function for polling the REopt API results URL until status is not "Optimizing..."
+    poll_results for v1 and v2 results URLs
+    """
+    return poll_results(url, poll_interval=poll_interval, v3=False, timing=timing, stop_event=stop_event)
+
+
+def poller_v3(url, poll_interval=5, timing=None, stop_event=None):
+    """
+    poll_results for v3 results URLs
+    """
+    return poll_results(url, poll_interval=poll_interval, v3=True, timing=timing, stop_event=stop_event)
+
+
+async def poller_async(url, poll_interval=5, executor=None, v3=True, timing=None):
+    """
+    Coroutine version of poll_results for use in asyncio batches. The blocking GET is run in `executor` so that
+    many results URLs can be polled concurrently from one event loop.
     :param url: results url to poll
     :param poll_interval: seconds
+    :param executor: concurrent.futures.Executor to run requests in; None uses the event loop's default executor
+    :param v3: True for v3 (/stable) responses, False for v1 and v2 responses
+    :param timing: optional dict, filled in with n_polls, download_bytes, download_seconds and done_time
     :return: dictionary response (once status is not "Optimizing...")
     """
-
+    loop = asyncio.get_event_loop()
     key_error_count = 0
-    key_error_threshold = 3
-    status = "Optimizing..."
     log.info("Polling {} for results with interval of {}s...".format(url, poll_interval))
     while True:
 
-        resp = requests.get(url=url, verify=False)
-        resp_dict = json.loads(resp.content)
-
-        try:
-            status = resp_dict['status']
-        except KeyError:
-            key_error_count += 1
-            log.info('KeyError count: {}'.format(key_error_count))
-            if key_error_count > key_error_threshold:
-                log.info('Breaking polling loop due to KeyError count threshold of {} exceeded.'
-                         .format(key_error_threshold))
-                break
+        request_time = time.time()
+        resp = await loop.run_in_executor(executor, functools.partial(get_session().get, url=url, verify=False))
+        resp_dict = load_response(resp)
+        record_poll(timing, resp, request_time)
 
+        status, key_error_count = poll_status(resp_dict, v3, key_error_count, url)
         if status != "Optimizing...":
             break
         else:
-            time.sleep(poll_interval)
+            await asyncio.sleep(poll_interval)
 
     return resp_dict
 
+
+def next_poll_interval(n_polls, initial_interval=5, max_interval=120, backoff=1.5, jitter=0.2):
+    """
+    Adaptive poll interval: short intervals while a job is young, growing geometrically for long-running jobs
+    (e.g. CHP or GHP scenarios) up to max_interval. Jitter spreads out polls of jobs that were submitted together.
+    :param n_polls: number of times the job has been polled so far
+    :param initial_interval: seconds before the first re-poll
+    :param max_interval: upper limit on seconds between polls
+    :param backoff: multiplier applied to the interval after every poll
+    :param jitter: fraction of the interval to randomly add or subtract
+    :return: seconds to wait before polling the job again
+    """
+    interval = min(max_interval, initial_interval * backoff ** n_polls)
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def poll_many(run_uuids, API_KEY, api_url, initial_interval=5, max_interval=120, backoff=1.5, jitter=0.2,
+              max_requests_per_second=2, timeout=None, cancel_event=None, on_result=None, metrics=None):
+    """
+    Poll the results of many runs from a single loop until none of them have status "Optimizing...".
+    Each run is polled on its own adaptive schedule (see next_poll_interval) and all polls share a global cap on
+    requests per second. Polling stops early at the timeout, when cancel_event is set, or on KeyboardInterrupt; runs
+    that have not finished are then left out of the returned dict (their run_uuids are logged so they can be polled
+    again later). A failed GET (eg. a connection error or timeout) is logged and the run is polled again later; a run
+    is given up on after more than KEY_ERROR_THRESHOLD failed GETs in a row, or more than KEY_ERROR_THRESHOLD
+    responses without a status.
+    :param run_uuids: iterable of run_uuids to poll
+    :param API_KEY:
+    :param api_url: eg. 'https://developer.nrel.gov/api/reopt/stable'
+    :param initial_interval: see next_poll_interval
+    :param max_interval: see next_poll_interval
+    :param backoff: see next_poll_interval
+    :param jitter: see next_poll_interval
+    :param max_requests_per_second: global limit on GET requests to the API
+    :param timeout: seconds after which polling gives up on all unfinished runs. None to poll until all finish.
+    :param cancel_event: optional threading.Event; setting it from another thread stops polling
+    :param on_result: optional callable(run_uuid, response_dict) called as soon as each run finishes
+    :param metrics: optional src.job_metrics.JobMetrics to record a timing record for each finished run
+    :return: dict of run_uuid: dictionary response, for every run that finished
+    """
+    results_url = api_url + '/job/<run_uuid>/results/?api_key=' + API_KEY
+    v3 = is_v3(results_url)
+    min_request_spacing = 1.0 / max_requests_per_second if max_requests_per_second else 0
+
+    start = time.time()
+    deadline = start + timeout if timeout is not None else None
+    # heap of (next poll time, run_uuid); first polls are staggered so that a new batch doesn't arrive at once
+    schedule = [(start + random.uniform(0, jitter * initial_interval), run_uuid) for run_uuid in run_uuids]
+    heapq.heapify(schedule)
+    timings = {run_uuid: dict(run_uuid=run_uuid) for _, run_uuid in schedule}
+    key_error_counts = {run_uuid: 0 for _, run_uuid in schedule}  # responses without a status
+    request_error_counts = {run_uuid: 0 for _, run_uuid in schedule}  # failed GETs since the last response
+    results = dict()
+    stopped = []  # runs that were given up on after repeated request errors
+    last_request = 0
+
+    def wait(seconds):
+        """ sleep for `seconds`, returning True if polling was cancelled in the meantime """
+        if seconds <= 0:
+            return cancel_event is not None and cancel_event.is_set()
+        if cancel_event is not None:
+            return cancel_event.wait(seconds)
+        time.sleep(seconds)
+        return False
+
+    log.info("Polling {} runs with intervals from {}s to {}s and at most {} requests/s..."
+             .format(len(schedule), initial_interval, max_interval, max_requests_per_second))
+    try:
+        while schedule:
+            next_time, run_uuid = schedule[0]
+            now = time.time()
+            wake_time = max(next_time, last_request + min_request_spacing)
+            if deadline is not None and wake_time > deadline:
+                log.warning("Polling timed out after {}s.".format(timeout))
+                break
+            if wait(wake_time - now):
+                log.warning("Polling cancelled.")
+                break
+            heapq.heappop(schedule)
+
+            last_request = time.time()
+            try:
+                resp = get_session().get(url=results_url.replace('<run_uuid>', run_uuid), verify=False)
+            except requests.exceptions.RequestException as e:
+                request_error_counts[run_uuid] += 1
+                log.warning('Polling {} failed ({}), errors in a row: {}'.format(run_uuid, e,
+                                                                                request_error_counts[run_uuid]))
+                if request_error_counts[run_uuid] > KEY_ERROR_THRESHOLD:
+                    log.warning('Stopped polling {} due to request error threshold of {} exceeded.'
+                                .format(run_uuid, KEY_ERROR_THRESHOLD))
+                    stopped.append(run_uuid)
+                else:
+                    interval = next_poll_interval(timings[run_uuid].get('n_polls', 0),
+                                                  initial_interval=initial_interval, max_interval=max_interval,
+                                                  backoff=backoff, jitter=jitter)
+                    heapq.heappush(schedule, (time.time() + interval, run_uuid))
+                continue
+            request_error_counts[run_uuid] = 0
+            resp_dict = load_response(resp)
+            record_poll(timings[run_uuid], resp, last_request)
+
+            status, key_error_counts[run_uuid] = poll_status(resp_dict, v3, key_error_counts[run_uuid], run_uuid)
+            if status != "Optimizing...":
+                log.info("Run {} finished with status {} after {} polls ({:.0f}s)."
+                         .format(run_uuid, status, timings[run_uuid]['n_polls'], time.time() - start))
+                results[run_uuid] = resp_dict
+                if metrics is not None:
+                    timing = timings[run_uuid]
+                    metrics.append(dict(timing, kind='job', source='api', status=status, start_time=start,
+                                        queue_solve_seconds=timing.pop('done_time') - start))
+                if on_result is not None:
+                    on_result(run_uuid, resp_dict)
+            else:
+                interval = next_poll_interval(timings[run_uuid]['n_polls'], initial_interval=initial_interval,
+                                              max_interval=max_interval, backoff=backoff, jitter=jitter)
+                heapq.heappush(schedule, (time.time() + interval, run_uuid))
+    except KeyboardInterrupt:
+        log.warning("Polling interrupted.")
+
+    unfinished = [r for _, r in schedule] + stopped
+    if unfinished:
+        log.warning("{} runs did not finish: {}".format(len(unfinished), ", ".join(unfinished)))
+
+    return results
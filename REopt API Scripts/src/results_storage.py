@@ -0,0 +1,140 @@
+"""
+Saving and loading API responses, optionally compressed.
+
+A v3 response is about 1 MB of JSON, almost all of it time-series lists, which compresses to a fraction of that with
+gzip or xz. load_results and open_results detect the format from the file contents, so plain and compressed files can
+be read the same way. Responses are decoded with orjson when it is installed.
+"""
+import gzip
+import io
+import json
+import lzma
+import os
+from src.logger import log
+
+try:
+    import orjson  # optional, decodes several times faster than json
+except ImportError:
+    orjson = None
+
+COMPRESSIONS = {
+    None: open,
+    'gzip': gzip.open,
+    'xz': lzma.open,
+}
+EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'xz': '.xz',
+}
+MAGIC_NUMBERS = {
+    b'\x1f\x8b': 'gzip',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+
+def results_path(results_file, compression=None):
+    """
+    :param results_file: path to save a response to, eg. 'outputs/results.json'
+    :param compression: None, 'gzip' or 'xz'
+    :return: results_file with the compression's extension added if it is missing, eg. 'outputs/results.json.gz'
+    """
+    ext = EXTENSIONS[compression]
+    if ext and not results_file.endswith(ext):
+        return results_file + ext
+    return results_file
+
+
+def save_results(results, results_file, compression=None):
+    """
+    Save an API response to a json file
+    :param results: results dictionary / API response
+    :param results_file: path to save to
+    :param compression: None for plain JSON (as from json.dump), 'gzip' or 'xz' for compressed JSON without whitespace
+    :return: path the results were saved to (with the compression's extension added if it was missing)
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("compression must be one of {}".format(list(COMPRESSIONS.keys())))
+    results_file = results_path(results_file, compression)
+
+    # json.dumps then one write is much faster than json.dump, which writes the encoded response in small chunks
+    if compression is None:
+        with open(results_file, 'w') as fp:
+            fp.write(json.dumps(results))
+    else:
+        with COMPRESSIONS[compression](results_file, 'wt') as fp:
+            fp.write(json.dumps(results, separators=(',', ':')))
+
+    log.info("Saved results to {}".format(results_file))
+    return results_file
+
+
+def detect_compression(results_file):
+    """
+    :param results_file: path to a saved response
+    :return: None, 'gzip' or 'xz'
+    """
+    with open(results_file, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_results(results_file, mode='rt'):
+    """
+    Open a saved response, decompressing it if needed
+    :param results_file: path to a plain or compressed json file
+    :param mode: 'rt' for text or 'rb' for bytes
+    :return: file object
+    """
+    compression = detect_compression(results_file)
+    if compression is None:
+        return open(results_file, mode)
+    if mode == 'rb':
+        return COMPRESSIONS[compression](results_file, 'rb')
+    return io.TextIOWrapper(COMPRESSIONS[compression](results_file, 'rb'))
+
+
+def load_results(results_file):
+    """
+    Load a saved response, whether it is plain or compressed JSON
+    :param results_file: path to a json file saved by save_results (or by json.dump)
+    :return: results dictionary / API response
+    """
+    with open_results(results_file, 'rb') as f:
+        return decode_json(f.read())
+
+
+def decode_json(data):
+    """
+    :param data: JSON bytes or str
+    :return: decoded JSON, with orjson if it is installed
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:  # eg. NaN, which json writes but orjson does not read
+            pass
+    return json.loads(data)
+
+
+def compress_results_files(results_files, compression='gzip', remove_original=True):
+    """
+    Convert existing plain json results files to a compressed format
+    :param results_files: list of paths to json files
+    :param compression: 'gzip' or 'xz'
+    :param remove_original: delete each original file once its compressed copy is written
+    :return: list of paths to the compressed files
+    """
+    compressed_files = []
+    for fp in results_files:
+        if detect_compression(fp) is not None:
+            compressed_files.append(fp)
+            continue
+        new_fp = save_results(load_results(fp), fp, compression=compression)
+        if remove_original and new_fp != fp:
+            os.remove(fp)
+        compressed_files.append(new_fp)
+    return compressed_files
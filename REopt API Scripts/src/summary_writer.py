@@ -0,0 +1,163 @@
+"""
+Writing a summary csv one response at a time.
+
+SummaryWriter appends each response's summary row to a rows file (eg. outputs/results_summary_rows.csv) as soon as
+the response is added, and flushes it, so the summary can be watched while a batch runs and nothing is lost if the
+batch stops. Each row is keyed by the site it belongs to (see row_key): the site_number custom column if there is one,
+or else the response's run_uuid (or the path of a saved response). Adding a row that is already in the rows file does
+nothing, so a batch can be rerun or resumed without duplicate rows, even if the input csv was edited in between.
+finalize writes the rows to the summary csv in the same format as parse_responses_to_csv_with_template, in the order
+of the rows file or in a given order of keys.
+
+Example:
+    summary = SummaryWriter('outputs/results_summary.csv', outputs=["Financial|npv", "PV|size_kw"],
+                            custom_columns=["site_number", "site_name"])
+    for site_number, site_name, resp in zip(site_numbers, site_names, responses):
+        custom_values = [site_number, site_name]
+        summary.add(summary.row_key(resp, custom_values), resp, custom_values=custom_values)
+    summary.finalize()
+"""
+import csv
+import os
+import threading
+from src.logger import log
+from src.output_extractor import OutputExtractor
+
+KEY_COLUMN = 'summary_row'  # first column of the rows file
+SITE_COLUMN = 'site_number'  # custom column that identifies a site, if there is one
+
+
+class SummaryWriter:
+    """
+    Append-only rows file of a summary csv, keyed by site (see row_key). Safe to share between threads.
+    """
+
+    def __init__(self, output_csv, outputs, custom_columns=(), rows_csv=None, resume=True):
+        """
+        :param output_csv: path to the summary csv written by finalize
+        :param outputs: names of the outputs to pull out of responses (the header of a results template csv)
+        :param custom_columns: names of the columns before the outputs (eg. custom columns of the input csv)
+        :param rows_csv: path to the rows file. Default is output_csv with "_rows" added to the name.
+        :param resume: if True, keep the rows already in the rows file; if False, start a new rows file
+        """
+        self.output_csv = output_csv
+        self.rows_csv = rows_csv or '{}_rows{}'.format(*os.path.splitext(output_csv))
+        self.columns = list(custom_columns) + list(outputs)
+        self.site_column = list(custom_columns).index(SITE_COLUMN) if SITE_COLUMN in custom_columns else None
+        self.extractor = OutputExtractor(outputs)
+        self.keys = set()
+        self._lock = threading.Lock()
+
+        if resume and os.path.isfile(self.rows_csv):
+            self.truncate_partial_row()
+            with open(self.rows_csv, 'r', newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is not None and header != [KEY_COLUMN] + self.columns:
+                    raise ValueError("{} has different columns than this summary; use resume=False to start a new "
+                                     "rows file.".format(self.rows_csv))
+                for row in reader:
+                    self.keys.add(row[0])
+            log.info("Resuming {} with {} rows".format(self.rows_csv, len(self.keys)))
+        else:
+            header = None
+        self._f = open(self.rows_csv, 'a' if header is not None else 'w', newline='')
+        self._writer = csv.writer(self._f)
+        if header is None:
+            self._writer.writerow([KEY_COLUMN] + self.columns)
+            self._f.flush()
+
+    def truncate_partial_row(self):
+        # a batch that stopped while writing leaves part of a row at the end of the file
+        with open(self.rows_csv, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def row_key(self, response, custom_values=(), default=None):
+        """
+        :param response: API response (v3 or v2), path to a saved response, or None
+        :param custom_values: values of the custom columns
+        :param default: key if neither the site_number column nor the response identify the site
+        :return: key of the site's row: its site_number custom column if there is one, or else the response's
+            run_uuid, or the path of a saved response (None if none of these nor default are known)
+        """
+        if self.site_column is not None and custom_values[self.site_column] not in (None, ''):
+            return str(custom_values[self.site_column])
+        if isinstance(response, str):
+            return response
+        if isinstance(response, dict):
+            run_uuid = response.get('run_uuid') or ((response.get('outputs') or dict()).get('Scenario') or
+                                                    dict()).get('run_uuid')
+            if run_uuid:
+                return run_uuid
+        return None if default is None else str(default)
+
+    def has(self, key):
+        """
+        :return: True if the row with key is already in the summary
+        """
+        return str(key) in self.keys
+
+    def add(self, key, response, custom_values=()):
+        """
+        Append the summary row of a response, unless its row is already in the summary
+        :param key: key of the site's row, eg. from row_key
+        :param response: API response (v3 or v2), or path to a saved response
+        :param custom_values: values of the custom columns
+        :return: True if the row was written
+        """
+        if self.has(key):
+            return False
+        return self.add_row(key, list(custom_values) + self.extractor.extract(response))
+
+    def add_row(self, key, values):
+        """
+        :param key: key of the site's row
+        :param values: values of the custom columns and outputs
+        :return: True if the row was written, False if the row was already in the summary
+        """
+        key = str(key)
+        with self._lock:
+            if key in self.keys:
+                return False
+            self._writer.writerow([key] + list(values))
+            self._f.flush()
+            self.keys.add(key)
+        return True
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+
+    def finalize(self, remove_rows=False, order=None):
+        """
+        Write the summary csv from the rows file
+        :param remove_rows: if True, delete the rows file afterwards
+        :param order: optional list of keys, eg. in the order of the input csv. Their rows are written first in this
+            order, followed by any other rows in the order of the rows file.
+        :return: number of rows in the summary
+        """
+        self.close()
+        rows = dict()
+        with open(self.rows_csv, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                rows.setdefault(row[0], row[1:])  # in the order of the rows file
+        n_rows = len(rows)
+        tmp = self.output_csv + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for key in order or ():
+                if str(key) in rows:
+                    writer.writerow(rows.pop(str(key)))
+            for row in rows.values():
+                writer.writerow(row)
+        os.replace(tmp, self.output_csv)
+        if remove_rows:
+            os.remove(self.rows_csv)
+        log.info("Wrote {} rows to {}".format(n_rows, self.output_csv))
+        return n_rows
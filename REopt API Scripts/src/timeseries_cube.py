@@ -0,0 +1,171 @@
+"""
+Time series of many scenarios in one memory-mapped array, so they can be analyzed together without reopening JSON.
+
+export_timeseries_cube first scans the saved responses for the names and lengths of their time series, without
+decoding them, and then reads each response once and writes its time series (eg.
+ElectricUtility|electric_to_load_series_kw and PV|electric_to_load_series_kw) into a NumPy .npy file of shape
+(scenario, series, timestep), with a JSON index of the scenario ids (run_uuid, or the file name) and the series names
+("Obj|field"). v2 responses are converted to the v3 shape first (see src.v2_to_v3_outputs), so legacy and new runs
+share series names. Series that are not in a response, or are empty (eg. PV outputs of a scenario without PV), are NaN.
+
+TimeSeriesCube maps the file read-only and returns views of it, without copying or parsing.
+
+Example, coincident peak of 2,000 sites:
+    export_timeseries_cube('outputs/results_*.json', 'outputs/timeseries_cube')
+    cube = TimeSeriesCube('outputs/timeseries_cube')
+    grid_kw = cube.series('ElectricUtility|electric_to_load_series_kw')  # sites x timesteps
+    peak_timestep = grid_kw.sum(axis=0).argmax()
+    site_kw_at_peak = grid_kw[:, peak_timestep]
+or from the command line:
+    python -m src.timeseries_cube "outputs/results_*.json" --cube-dir outputs/timeseries_cube
+"""
+import argparse
+import json
+import os
+import numpy as np
+from src.bulk_results_parser import find_results_files
+from src.load_profile_store import VALID_LENGTHS
+from src.logger import log
+from src.output_extractor import output_objects
+from src.result_reader import scan_array_lengths
+from src.results_storage import load_results, open_results
+from src.v2_to_v3_outputs import convert_response, get_outputs_map
+
+DTYPE = np.dtype('<f8')
+
+
+def find_series(results_file, outputs_map):
+    """
+    :param results_file: path to a saved v3 or v2 response
+    :param outputs_map: OutputsMap, to convert the names of v2 series
+    :return: dict of "Obj|field" key: number of values, of the response's time series (lists of 8760, 17520 or 35040
+        values), without decoding the response (see src.result_reader.scan_array_lengths)
+    """
+    with open_results(results_file, 'rt') as f:
+        v2, lengths = scan_array_lengths(f.read())
+    series = dict()
+    for (obj, field), n in lengths.items():
+        if n not in VALID_LENGTHS:
+            continue
+        if v2:
+            target = outputs_map.lookup(obj, field)[0]
+            if target is None or target[0] is None:
+                continue
+            obj, field = target
+        series.setdefault('{}|{}'.format(obj, field), n)
+    return series
+
+
+def scenario_id(resp, default):
+    return resp.get('run_uuid') or default
+
+
+def export_timeseries_cube(results_files, cube_dir='outputs/timeseries_cube', series=None, dtype=DTYPE):
+    """
+    Write the time series of saved responses to a memory-mapped cube (see module docstring)
+    :param results_files: list of paths to saved v3 or v2 responses (plain or compressed), a glob pattern, or a
+        directory of saved responses (see src.bulk_results_parser.find_results_files)
+    :param cube_dir: directory for cube.npy and index.json, created if it does not exist
+    :param series: list of "Obj|field" keys of the series to export; default is every series in any of the responses
+    :param dtype: numpy dtype of the cube
+    :return: shape of the cube (n scenarios, n series, n timesteps)
+    """
+    results_files = find_results_files(results_files)
+    if not results_files:
+        log.warning("No results files to export.")
+        return 0, 0, 0
+    os.makedirs(cube_dir, exist_ok=True)
+    cube_file = os.path.join(cube_dir, 'cube.npy')
+    index_file = os.path.join(cube_dir, 'index.json')
+    outputs_map = get_outputs_map()
+
+    # first pass: the series in any of the responses, and their number of timesteps
+    lengths = dict()
+    for fp in results_files:
+        for key, n in find_series(fp, outputs_map).items():
+            lengths.setdefault(key, set()).add(n)
+    series = list(series or lengths.keys())
+    n_timesteps = max([n for key in series for n in lengths.get(key, ())] + [0])
+    for key in series:
+        if key not in lengths:
+            log.warning("{} is not in any of the results files.".format(key))
+
+    shape = (len(results_files), len(series), n_timesteps)
+    cube = np.lib.format.open_memmap(cube_file + '.tmp', mode='w+', dtype=dtype, shape=shape)
+    paths = [tuple(key.split('|', 1)) for key in series]
+    scenario_ids = []
+    for i, fp in enumerate(results_files):
+        resp = convert_response(load_results(fp), outputs_map)[0]
+        objects = output_objects(resp)
+        cube[i] = np.nan
+        for j, (obj, field) in enumerate(paths):
+            values = objects.get(obj, dict()).get(field)
+            if not values:  # not in the response, or empty (eg. v2 PV outputs of a scenario without PV)
+                continue
+            if len(values) != n_timesteps:
+                log.warning("{}|{} of {} has {} values, not {}, and was left out.".format(
+                    obj, field, fp, len(values), n_timesteps))
+                continue
+            cube[i, j] = np.asarray(values, dtype=float)  # None (null) values become NaN
+        scenario_ids.append(scenario_id(resp, os.path.basename(fp)))
+
+    cube.flush()
+    del cube
+    os.replace(cube_file + '.tmp', cube_file)
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump({'scenario_ids': scenario_ids, 'series': series, 'files': list(results_files)}, f)
+    os.replace(index_file + '.tmp', index_file)
+    log.info("Exported {} series of {} scenarios to {}".format(len(series), len(scenario_ids), cube_dir))
+    return shape
+
+
+class TimeSeriesCube:
+    """
+    Read-only memory map of a cube written by export_timeseries_cube
+    """
+
+    def __init__(self, cube_dir='outputs/timeseries_cube'):
+        """
+        :param cube_dir: directory with cube.npy and index.json
+        """
+        with open(os.path.join(cube_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+        self.scenario_ids = index['scenario_ids']
+        self.series_names = index['series']
+        self.files = index['files']
+        self.data = np.load(os.path.join(cube_dir, 'cube.npy'), mmap_mode='r')  # scenario x series x timestep
+        self._scenarios = {s: i for i, s in enumerate(self.scenario_ids)}
+        self._series = {s: j for j, s in enumerate(self.series_names)}
+
+    def series(self, name):
+        """
+        :param name: "Obj|field" key of a series
+        :return: view of the series for every scenario (scenario x timestep)
+        """
+        return self.data[:, self._series[name], :]
+
+    def scenario(self, scenario_id):
+        """
+        :param scenario_id: run_uuid (or file name) of a scenario
+        :return: view of every series of the scenario (series x timestep)
+        """
+        return self.data[self._scenarios[scenario_id]]
+
+    def get(self, scenario_id, name):
+        """
+        :return: view of one series of one scenario
+        """
+        return self.data[self._scenarios[scenario_id], self._series[name]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the time series of saved responses to a memory-mapped cube.")
+    parser.add_argument('results_files', nargs='+', help="paths, glob patterns or directories of saved responses")
+    parser.add_argument('--cube-dir', default='outputs/timeseries_cube')
+    parser.add_argument('--series', nargs='*', help="Obj|field keys of the series to export (default is all)")
+    args = parser.parse_args()
+
+    files = []
+    for pattern in args.results_files:
+        files += find_results_files(pattern) or [pattern]
+    export_timeseries_cube(files, args.cube_dir, series=args.series)
@@ -0,0 +1,245 @@
+"""
+Translating archived v2 posts and input csv files to v3 inputs, using v2_v3_inputs_map.csv.
+
+The map is compiled once into a lookup of (v2 object, v2 field) to (v3 object, v3 field). v2 inputs that have no v3
+equivalent are left out and reported, with one of these statuses:
+    removed         "(Removed in v3)" in the map
+    not yet in v3   the v3 object is marked "(not yet in v3)"
+    changed         "(Changed in v3)", eg. LoadProfileBoilerFuel inputs that are split into SpaceHeatingLoad and
+                    DomesticHotWaterLoad; these need to be translated by hand
+    unmapped        the input is not in the map
+    conflict        two v2 inputs map to the same v3 input (eg. optimality_tolerance_bau and _techs); the first is kept
+Values are copied as they are: v2 "_pct" inputs were already fractions.
+
+In v2 posts the inputs are under Scenario (eg. time_steps_per_hour), Scenario -> Site (eg. latitude) and
+Scenario -> Site -> <object> (eg. LoadProfile). v3 posts have an object at the top level for each, and APIMeta inputs
+(user_uuid, webtool_uuid) at the top level of the post.
+
+Example, from the "REopt API Scripts" directory:
+    v3_post, issues = translate_post(json.load(open('archived_v2_scripts/inputs/Scenario_POST1.json')))
+    issues = translate_csv('archived_v2_scripts/inputs/scenarios.csv', 'inputs/scenarios_v3.csv')
+"""
+import csv
+import glob
+import json
+import os
+import pandas as pd
+from src.logger import log
+
+DEFAULT_INPUTS_MAP = os.path.join(os.path.dirname(__file__), '..', '..', 'v2_v3_inputs_map.csv')
+TOP_LEVEL_OBJECTS = ['APIMeta']  # v3 objects whose inputs are at the top level of the post
+
+_inputs_map = None
+
+
+class InputsMap:
+    """
+    v2_v3_inputs_map.csv compiled into lookups of v2 inputs
+    """
+
+    def __init__(self, map_file=DEFAULT_INPUTS_MAP):
+        """
+        :param map_file: path to the map csv, with columns v2_key, v2_field, v3_key, v3_field
+        """
+        self.map_file = map_file
+        self.fields = dict()  # (v2 object, v2 field): (v3 object, v3 field)
+        self.dropped = dict()  # (v2 object, v2 field): (status, note)
+        self.v2_objects = dict()  # v2 field: set of v2 objects that have it, for plain csv columns
+
+        with open(map_file, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                row = {k: (v or '').strip() for k, v in row.items()}  # some cells have trailing spaces
+                v2_key, v2_field, v3_key, v3_field = row['v2_key'], row['v2_field'], row['v3_key'], row['v3_field']
+                if v2_key in ('', '---') or v2_field.startswith('('):
+                    continue  # added in v3, nothing to translate
+                key = (v2_key, v2_field)
+                self.v2_objects.setdefault(v2_field, set()).add(v2_key)
+                if v3_field == '(Removed in v3)':
+                    self.dropped[key] = ('removed', v3_field)
+                elif '(not yet in v3)' in v3_key:
+                    self.dropped[key] = ('not yet in v3', v3_key)
+                elif v3_key == '(Changed in v3)':
+                    self.dropped[key] = ('changed', v3_field)
+                elif key in self.fields:  # more than one v3 input: prefer the one with the same name
+                    if v3_field == v2_field:
+                        self.fields[key] = (v3_key, v3_field)
+                else:
+                    self.fields[key] = (v3_key, v3_field)
+        log.debug("Compiled {} v2 to v3 inputs from {}".format(len(self.fields), map_file))
+
+    def lookup(self, v2_obj, v2_field):
+        """
+        :return: ((v3 object, v3 field), None) for a translated input, or (None, (status, note)) otherwise
+        """
+        target = self.fields.get((v2_obj, v2_field))
+        if target is not None:
+            return target, None
+        return None, self.dropped.get((v2_obj, v2_field), ('unmapped', ''))
+
+
+def get_inputs_map():
+    """
+    :return: the InputsMap of the repo's v2_v3_inputs_map.csv, compiled on first use
+    """
+    global _inputs_map
+    if _inputs_map is None:
+        _inputs_map = InputsMap()
+    return _inputs_map
+
+
+def iter_v2_inputs(v2_post):
+    """
+    :param v2_post: nested v2 post ({"Scenario": {..., "Site": {..., "PV": {...}}}})
+    :return: generator of (v2 object, v2 field, value), with object "Scenario" or "Site" for their own inputs
+    """
+    scenario = v2_post.get('Scenario', v2_post)
+    for k, v in scenario.items():
+        if k != 'Site':
+            yield 'Scenario', k, v
+    for k, v in scenario.get('Site', dict()).items():
+        if k[0].isupper() and isinstance(v, dict):
+            for field, value in v.items():
+                yield k, field, value
+        else:
+            yield 'Site', k, v
+
+
+def translate_post(v2_post, inputs_map=None):
+    """
+    :param v2_post: nested v2 post
+    :param inputs_map: InputsMap, default is the repo's map
+    :return: (v3_post, issues), where issues is a list of dicts with key (v2 "Obj|field"), status and note
+    """
+    inputs_map = inputs_map or get_inputs_map()
+    v3_post = dict()
+    sources = dict()
+    issues = []
+    for v2_obj, v2_field, value in iter_v2_inputs(v2_post):
+        target, dropped = inputs_map.lookup(v2_obj, v2_field)
+        if target is None:
+            issues.append({'key': v2_obj + '|' + v2_field, 'status': dropped[0], 'note': dropped[1]})
+            continue
+        v3_obj, v3_field = target
+        d = v3_post if v3_obj in TOP_LEVEL_OBJECTS else v3_post.setdefault(v3_obj, dict())
+        if v3_field in d:
+            issues.append({'key': v2_obj + '|' + v2_field, 'status': 'conflict',
+                           'note': "{}|{} already set from {}".format(v3_obj, v3_field, sources[target])})
+            continue
+        d[v3_field] = value
+        sources[target] = v2_obj + '|' + v2_field
+    return v3_post, issues
+
+
+def translate_posts(v2_posts, inputs_map=None):
+    """
+    :param v2_posts: iterable of nested v2 posts
+    :param inputs_map: InputsMap, default is the repo's map
+    :return: generator of (v3_post, issues)
+    """
+    inputs_map = inputs_map or get_inputs_map()
+    for v2_post in v2_posts:
+        yield translate_post(v2_post, inputs_map)
+
+
+def translate_post_files(v2_files, output_dir, inputs_map=None):
+    """
+    Translate saved v2 posts (json files) and save the v3 posts to output_dir with the same file names
+    :param v2_files: list of paths, or a glob pattern such as 'archived_v2_scripts/inputs/Scenario_POST*.json'
+    :param output_dir: directory for the v3 posts, created if it does not exist
+    :param inputs_map: InputsMap, default is the repo's map
+    :return: list of issues, each with the file name added
+    """
+    if isinstance(v2_files, str):
+        v2_files = sorted(glob.glob(v2_files))
+    os.makedirs(output_dir, exist_ok=True)
+    all_issues = []
+    for fp in v2_files:
+        with open(fp, 'r') as f:
+            v3_post, issues = translate_post(json.load(f), inputs_map)
+        with open(os.path.join(output_dir, os.path.basename(fp)), 'w') as f:
+            json.dump(v3_post, f, indent=2)
+        all_issues += [dict(issue, file=fp) for issue in issues]
+    log_issues(all_issues)
+    return all_issues
+
+
+def translate_columns(columns, inputs_map=None):
+    """
+    Translate the column names of a v2 multi-site input csv
+    :param columns: column names: "Obj|field" (with "Scenario|" and "Site|" for their own inputs), or plain field
+        names, which make_nested_dict applies to every object with that field. Columns that are not v2 inputs (eg.
+        site_number, load_file) are kept as they are.
+    :param inputs_map: InputsMap, default is the repo's map
+    :return: (dict of v2 column: v3 column, or None for columns to drop, list of issues)
+    """
+    inputs_map = inputs_map or get_inputs_map()
+    renames, issues, sources = dict(), [], dict()
+    for column in columns:
+        if '|' in column:
+            v2_obj, v2_field = column.split('|', 1)
+            target, dropped = inputs_map.lookup(v2_obj, v2_field)
+            if target is None:
+                issues.append({'key': column, 'status': dropped[0], 'note': dropped[1]})
+                renames[column] = None
+                continue
+            new_column = target[1] if target[0] in TOP_LEVEL_OBJECTS else '|'.join(target)
+        elif column in inputs_map.v2_objects:
+            targets = set(inputs_map.lookup(v2_obj, column)[0] for v2_obj in inputs_map.v2_objects[column])
+            fields = set(t[1] for t in targets if t is not None)
+            if len(fields) == 1:
+                new_column = fields.pop()
+            elif not fields:
+                status, note = inputs_map.lookup(sorted(inputs_map.v2_objects[column])[0], column)[1]
+                issues.append({'key': column, 'status': status, 'note': note})
+                renames[column] = None
+                continue
+            else:
+                issues.append({'key': column, 'status': 'unmapped',
+                               'note': "plain column is a different v3 input for each object: {}".format(
+                                   sorted('|'.join(t) for t in targets if t is not None))})
+                new_column = column
+        else:
+            new_column = column  # custom column
+        if new_column in sources:
+            issues.append({'key': column, 'status': 'conflict',
+                           'note': "{} already set from {}".format(new_column, sources[new_column])})
+            renames[column] = None
+            continue
+        sources[new_column] = column
+        renames[column] = new_column
+    return renames, issues
+
+
+def translate_csv(v2_csv, v3_csv, inputs_map=None, chunksize=10000):
+    """
+    Translate a v2 multi-site input csv (eg. all_api_inputs.csv style) to v3 column names, a chunk of rows at a time
+    :param v2_csv: path to the v2 csv
+    :param v3_csv: path to write the v3 csv to
+    :param inputs_map: InputsMap, default is the repo's map
+    :param chunksize: number of rows to read at a time
+    :return: list of issues (one per column)
+    """
+    issues = None
+    for i, df in enumerate(pd.read_csv(v2_csv, chunksize=chunksize)):
+        if issues is None:
+            renames, issues = translate_columns(df.columns, inputs_map)
+            keep = [c for c in df.columns if renames[c] is not None]
+        df = df[keep].rename(columns=renames)
+        df.to_csv(v3_csv, index=False, mode='w' if i == 0 else 'a', header=(i == 0))
+    log_issues(issues or [])
+    return issues or []
+
+
+def log_issues(issues, kind='input'):
+    """
+    Log a summary of the inputs (or outputs) that were not translated
+    :param issues: list of issues from translate_post, translate_columns, etc.
+    :param kind: 'input' or 'output', for the log message
+    :return: None
+    """
+    counts = dict()
+    for issue in issues:
+        counts.setdefault((issue['status'], issue['key']), []).append(issue)
+    for (status, key), found in sorted(counts.items()):
+        log.warning("v2 {} {} was not translated ({}{}), {} time(s).".format(
+            kind, key, status, ": " + found[0]['note'] if found[0]['note'] else "", len(found)))
@@ -0,0 +1,180 @@
+"""
+Converting archived v2 API responses to the v3 response shape, using v2_v3_outputs_map.csv.
+
+v2 outputs are nested under outputs -> Scenario -> Site -> <object> (eg. LoadProfile, Storage) with v2 names; v3
+outputs are under outputs -> <object> (eg. ElectricLoad, ElectricStorage) with v3 names, and status, run_uuid and
+api_version ("APIMeta (no key)" in the map) are at the top level of the response. The map is compiled once and each
+response is converted as it is read, so whole directories of legacy runs can be converted (or summarized, see
+iter_v3_results) alongside v3 runs without holding them all in memory.
+
+v2 outputs without a v3 equivalent are left out and reported as in src.v2_to_v3_inputs: removed, not yet in v3 (or
+"not in v3 master"), no corresponding v3 output, unmapped, or conflict.
+
+Example, from the "REopt API Scripts" directory:
+    converted_files = convert_v2_results('archived_v2_scripts/outputs/site3-*.json', output_dir='outputs/v3_converted')
+or, to summarize legacy and new runs together:
+    for fp, response in iter_v3_results(['archived_v2_scripts/outputs/site3-No-PV.json', 'outputs/results_file.json']):
+        npv = response['outputs']['Financial']['npv']
+"""
+import csv
+import os
+from src.bulk_results_parser import find_results_files
+from src.logger import log
+from src.results_storage import load_results, save_results
+from src.v2_to_v3_inputs import log_issues, translate_post
+
+DEFAULT_OUTPUTS_MAP = os.path.join(os.path.dirname(__file__), '..', '..', 'v2_v3_outputs_map.csv')
+TOP_LEVEL_OBJECTS = ['APIMeta (no key)']  # v3 objects whose outputs are at the top level of the response
+
+_outputs_map = None
+
+
+class OutputsMap:
+    """
+    v2_v3_outputs_map.csv compiled into a lookup of v2 outputs
+    """
+
+    def __init__(self, map_file=DEFAULT_OUTPUTS_MAP):
+        """
+        :param map_file: path to the map csv, with columns v2_key, v2_name, v3_key, v3_name
+        """
+        self.map_file = map_file
+        self.fields = dict()  # (v2 object, v2 name): (v3 object or None for the top level, v3 name)
+        self.dropped = dict()  # (v2 object, v2 name): (status, note)
+
+        with open(map_file, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                row = {k: (v or '').strip() for k, v in row.items()}  # some cells have trailing spaces
+                v2_key, v2_name, v3_key, v3_name = row['v2_key'], row['v2_name'], row['v3_key'], row['v3_name']
+                if v2_key in ('', '---') or v2_name.startswith('('):
+                    continue  # added in v3, nothing to convert
+                key = (v2_key, v2_name)
+                if v3_key in TOP_LEVEL_OBJECTS:
+                    self.fields[key] = (None, v3_name)
+                elif v3_name.startswith('('):  # (Removed in v3) or (No corresponding v3 output)
+                    self.dropped[key] = (v3_name.strip('()').lower(), '')
+                elif '(' in v3_key:  # eg. "ElectricTariff (not yet in v3)"
+                    self.dropped[key] = (v3_key[v3_key.index('(') + 1:].rstrip(')'), v3_key)
+                elif v3_key in ('', '---'):
+                    self.dropped[key] = ('unmapped', '')
+                else:
+                    self.fields[key] = (v3_key, v3_name)
+        log.debug("Compiled {} v2 to v3 outputs from {}".format(len(self.fields), map_file))
+
+    def lookup(self, v2_obj, v2_name):
+        """
+        :return: ((v3 object or None, v3 name), None) for a converted output, or (None, (status, note)) otherwise
+        """
+        target = self.fields.get((v2_obj, v2_name))
+        if target is not None:
+            return target, None
+        return None, self.dropped.get((v2_obj, v2_name), ('unmapped', ''))
+
+
+def get_outputs_map():
+    """
+    :return: the OutputsMap of the repo's v2_v3_outputs_map.csv, compiled on first use
+    """
+    global _outputs_map
+    if _outputs_map is None:
+        _outputs_map = OutputsMap()
+    return _outputs_map
+
+
+def is_v2_response(response):
+    return 'status' not in response and 'Scenario' in response.get('outputs', dict())
+
+
+def iter_v2_outputs(response):
+    """
+    :param response: v2 API response
+    :return: generator of (v2 object, v2 name, value), with object "Scenario" or "Site" for their own outputs
+    """
+    scenario = response['outputs']['Scenario']
+    for k, v in scenario.items():
+        if k == 'Site':
+            continue
+        if k[0].isupper() and isinstance(v, dict):  # eg. Profile
+            for name, value in v.items():
+                yield k, name, value
+        else:
+            yield 'Scenario', k, v
+    for k, v in scenario.get('Site', dict()).items():
+        if k[0].isupper() and isinstance(v, dict):
+            for name, value in v.items():
+                yield k, name, value
+        else:
+            yield 'Site', k, v
+
+
+def convert_response(response, outputs_map=None, include_inputs=False):
+    """
+    :param response: v2 API response (v3 responses are returned as they are)
+    :param outputs_map: OutputsMap, default is the repo's map
+    :param include_inputs: if True, the inputs are translated too (see src.v2_to_v3_inputs.translate_post)
+    :return: (v3 shaped response, issues), where issues is a list of dicts with key (v2 "Obj|name"), status and note
+    """
+    if not is_v2_response(response):
+        return response, []
+    outputs_map = outputs_map or get_outputs_map()
+    v3_response = {'run_uuid': None, 'api_version': None, 'status': None, 'inputs': dict(), 'outputs': dict(),
+                   'messages': response.get('messages', dict())}
+    sources = dict()
+    issues = []
+    for v2_obj, v2_name, value in iter_v2_outputs(response):
+        target, dropped = outputs_map.lookup(v2_obj, v2_name)
+        if target is None:
+            issues.append({'key': v2_obj + '|' + v2_name, 'status': dropped[0], 'note': dropped[1]})
+            continue
+        v3_obj, v3_name = target
+        d = v3_response if v3_obj is None else v3_response['outputs'].setdefault(v3_obj, dict())
+        if target in sources:
+            issues.append({'key': v2_obj + '|' + v2_name, 'status': 'conflict',
+                           'note': "{}|{} already set from {}".format(v3_obj, v3_name, sources[target])})
+            continue
+        d[v3_name] = value
+        sources[target] = v2_obj + '|' + v2_name
+    if include_inputs and 'inputs' in response:
+        v3_response['inputs'] = translate_post(response['inputs'])[0]
+    return v3_response, issues
+
+
+def iter_v3_results(results_files, outputs_map=None, include_inputs=False):
+    """
+    Load saved responses one at a time, converting v2 responses to the v3 shape
+    :param results_files: list of paths to saved v2 or v3 responses (plain or compressed), a glob pattern, or a
+        directory of saved responses (see src.bulk_results_parser.find_results_files)
+    :param outputs_map: OutputsMap, default is the repo's map
+    :param include_inputs: if True, the inputs of v2 responses are translated too
+    :return: generator of (path, v3 shaped response)
+    """
+    results_files = find_results_files(results_files)
+    outputs_map = outputs_map or get_outputs_map()
+    issues = []
+    for fp in results_files:
+        response, response_issues = convert_response(load_results(fp), outputs_map, include_inputs=include_inputs)
+        issues += response_issues
+        yield fp, response
+    log_issues(issues, kind='output')
+
+
+def convert_v2_results(results_files, output_dir, outputs_map=None, include_inputs=False, compression=None):
+    """
+    Convert saved v2 responses to the v3 shape and save them to output_dir with the same file names
+    :param results_files: list of paths to saved responses, a glob pattern such as
+        'archived_v2_scripts/outputs/site3-*.json', or a directory of saved responses
+    :param output_dir: directory for the converted responses, created if it does not exist
+    :param outputs_map: OutputsMap, default is the repo's map
+    :param include_inputs: if True, the inputs are translated too
+    :param compression: None, 'gzip' or 'xz' (see src.results_storage.save_results)
+    :return: list of paths to the converted responses
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    converted = []
+    for fp, response in iter_v3_results(results_files, outputs_map, include_inputs=include_inputs):
+        name = os.path.basename(fp)
+        for ext in ('.gz', '.xz'):
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+        converted.append(save_results(response, os.path.join(output_dir, name), compression=compression))
+    return converted